@@ -2,6 +2,7 @@ import sys
 import traceback
 import os 
 import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from appli.scripts.acquisition.sirene import download_sirene
 from appli.scripts.acquisition.bpe import download_bpe
@@ -35,11 +36,18 @@ def clean_cache():
 
 def main():
     print("=== STARTING DATA ACQUISITION ===\n")
-    safe_run("SIRENE Download", download_sirene)
-    safe_run("BPE Download", download_bpe)
-    safe_run("OSM Download", download_osm)
-    safe_run("Census Download", download_recens)
-    safe_run("BD TOPO Download", download_topo)
+    tasks = [
+        ("SIRENE Download", download_sirene),
+        ("BPE Download", download_bpe),
+        ("OSM Download", download_osm),
+        ("Census Download", download_recens),
+        ("BD TOPO Download", download_topo),
+    ]
+    # Downloads are I/O-bound and independent: run them concurrently
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = [executor.submit(safe_run, name, func) for name, func in tasks]
+        for future in as_completed(futures):
+            future.result()
     clean_cache()
     print("\n=== DATA ACQUISITION COMPLETED ===")
 
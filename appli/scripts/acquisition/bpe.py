@@ -1,52 +1,86 @@
 """
 Script : bpe.py
 Objective : Download the BPE (Base Permanente des Établissements) dataset from INSEE,
-            filter it by department, and convert it to GeoJSON format.
+            filter it by department, and convert it to GeoParquet format.
 Author : LEDERMANN Quentin
 Date : June 2025
 Usage : Script for acquiring and preprocessing BPE data for a specific department.
 """
 
 import os
-import pandas as pd
 import requests
+import pandas as pd
 import geopandas as gpd
+import shapely
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pac
 from zipfile import ZipFile
-from io import BytesIO
-from appli.scripts.acquisition.download_utils import load_config, print_status
+from appli.scripts.acquisition.download_utils import load_config, print_status, download_to_tempfile
+
+# Cast a string column to float64; if Arrow cannot parse some values, they become null
+# instead of failing the whole read
+def to_float64(array):
+    try:
+        return pc.cast(array, pa.float64())
+    except pa.ArrowInvalid:
+        return pa.array(pd.to_numeric(array.to_pandas(), errors="coerce"), type=pa.float64())
 
-# Function to download the BPE dataset from INSEE, filter by department, and convert to GeoJSON
+# Function to download the BPE dataset from INSEE, filter by department, and convert to GeoParquet
 def download_bpe():
     # Load configuration to get the department number
     config = load_config()
     departement = config["departement"]
     url = "https://www.insee.fr/fr/statistiques/fichier/8217525/BPE23.zip"
-    output_geojson = f"appli/data/bpe/bpe_{departement}.geojson"
+    output_path = f"appli/data/bpe/bpe_{departement}.parquet"
     os.makedirs("appli/data/bpe", exist_ok=True)
 
     # Download the BPE ZIP file
     print_status("Downloading BPE", "info")
-    r = requests.get(url)
-    if r.status_code != 200:
-        print_status("Downloading BPE", "err", f"HTTP Code {r.status_code}")
+    try:
+        zip_path = download_to_tempfile(url, suffix=".zip")
+    except requests.HTTPError as e:
+        print_status("Downloading BPE", "err", f"HTTP Code {e.response.status_code}")
+        return
+    except (requests.RequestException, IOError) as e:
+        print_status("Downloading BPE", "err", str(e))
         return
 
-    # Extract the ZIP file and filter by department
-    with ZipFile(BytesIO(r.content)) as z:
-        with z.open("BPE23.csv") as csv_file:
-            df = pd.read_csv(csv_file, sep=";", dtype=str, encoding="utf-8")
-            df_filtered = df[df["DEP"].str.startswith(departement, na=False)].copy()
+    # Stream the CSV out of the ZIP file with Arrow, reading every column as a string and keeping
+    # only the department's rows of each block, so only those rows are ever materialized.
+    # Coordinates are then cast to float64 (unparsable values become null) and rows without
+    # finite coordinates are dropped.
+    try:
+        with ZipFile(zip_path) as z:
+            with z.open("BPE23.csv") as csv_file:
+                columns = [c.strip('"') for c in csv_file.readline().decode("utf-8-sig").strip().split(";")]
+                reader = pac.open_csv(
+                    csv_file,
+                    read_options=pac.ReadOptions(column_names=columns, block_size=32 << 20),
+                    parse_options=pac.ParseOptions(delimiter=";"),
+                    convert_options=pac.ConvertOptions(
+                        column_types={col: pa.string() for col in columns}, strings_can_be_null=True
+                    ),
+                )
+                batches = [batch.filter(pc.starts_with(batch["DEP"], departement)) for batch in reader]
+                table = pa.Table.from_batches(batches, schema=reader.schema)
+        for col in ("LAMBERT_X", "LAMBERT_Y"):
+            table = table.set_column(table.schema.get_field_index(col), col, to_float64(table[col]))
+        table = table.filter(pc.and_(pc.is_finite(table["LAMBERT_X"]), pc.is_finite(table["LAMBERT_Y"])))
+    finally:
+        os.remove(zip_path)
 
-    # Process and convert to GeoJSON
+    # Build the point geometries in one batch and convert to GeoParquet
     try:
-        df_filtered["x"] = pd.to_numeric(df_filtered["LAMBERT_X"], errors="coerce")
-        df_filtered["y"] = pd.to_numeric(df_filtered["LAMBERT_Y"], errors="coerce")
-        df_geo = df_filtered.dropna(subset=["x", "y"])  # Remove rows with invalid coordinates
-        gdf = gpd.GeoDataFrame(df_geo, geometry=gpd.points_from_xy(df_geo["x"], df_geo["y"]), crs="EPSG:2154")
-        gdf.to_file(output_geojson, driver="GeoJSON")  # Save as GeoJSON
+        x = table["LAMBERT_X"].to_numpy()
+        y = table["LAMBERT_Y"].to_numpy()
+        df = table.to_pandas()
+        df["x"], df["y"] = x, y
+        gdf = gpd.GeoDataFrame(df, geometry=shapely.points(x, y), crs="EPSG:2154")
+        gdf.to_parquet(output_path)  # Save as GeoParquet
         print_status("BPE downloaded and converted", "ok")
     except Exception as e:
-        print_status("BPE GeoJSON conversion failed", "err", str(e))
+        print_status("BPE GeoParquet conversion failed", "err", str(e))
 
 # Entry point
 if __name__ == "__main__":
@@ -1,5 +1,21 @@
+import functools
+import gzip
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import requests
 import yaml
+from concurrent.futures import ThreadPoolExecutor
 
+# Serialises console output when acquisition steps run in parallel threads
+_print_lock = threading.Lock()
+
+# Parsed once per process: every script of the pipeline reads the same settings file
+@functools.lru_cache(maxsize=None)
 def load_config(path="appli/config/settings.yaml"):
     with open(path, "r") as f:
         return yaml.safe_load(f)
@@ -10,4 +26,108 @@ def print_status(step: str, status: str = "ok", detail: str = ""):
     message = f"{symbol} {step}"
     if detail:
         message += f" : {detail}"
-    print(message)
+    with _print_lock:
+        print(message)
+
+# One pooled HTTP session per thread, so repeated requests reuse keep-alive connections
+_session_local = threading.local()
+
+def get_session():
+    if not hasattr(_session_local, "session"):
+        _session_local.session = requests.Session()
+    return _session_local.session
+
+# Seconds to wait for the server to connect or send data before giving up
+TIMEOUT = 60
+
+def _download_range(url, path, start, end):
+    # Fetch bytes [start, end] of the remote file and write them at the same offset of the local file.
+    # Returns the number of bytes written, or None if the server ignored the Range header (no 206).
+    headers = {"Range": f"bytes={start}-{end}"}
+    with get_session().get(url, headers=headers, stream=True, timeout=TIMEOUT) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            return None
+        written = 0
+        with open(path, "r+b") as f:
+            f.seek(start)
+            for chunk in r.iter_content(chunk_size=1 << 20):
+                f.write(chunk)
+                written += len(chunk)
+    return written
+
+def download_file(url, path, n_parts=8, min_part_size=16 << 20):
+    # Download a remote file to path. Large files served with byte-range support are fetched
+    # as n_parts concurrent Range requests; otherwise the file is streamed in 1 MB chunks.
+    head = get_session().head(url, allow_redirects=True, timeout=TIMEOUT)
+    size = int(head.headers.get("Content-Length", 0))
+    ranges_ok = head.headers.get("Accept-Ranges", "").lower() == "bytes" and "Content-Encoding" not in head.headers
+    if head.ok and ranges_ok and size >= n_parts * min_part_size:
+        with open(path, "wb") as f:
+            f.truncate(size)
+        bounds = [size * i // n_parts for i in range(n_parts + 1)]
+        with ThreadPoolExecutor(max_workers=n_parts) as executor:
+            futures = [executor.submit(_download_range, head.url, path, bounds[i], bounds[i + 1] - 1) for i in range(n_parts)]
+            written = [future.result() for future in futures]
+        # Every part must have come back as a 206 of exactly its own length
+        if all(w == bounds[i + 1] - bounds[i] for i, w in enumerate(written)):
+            return path
+        print_status("Download", "info", f"range requests not honoured, streaming {url} instead")
+    with get_session().get(url, stream=True, timeout=TIMEOUT) as r:
+        r.raise_for_status()
+        written = 0
+        with open(path, "wb") as f:
+            for chunk in r.iter_content(chunk_size=1 << 20):
+                f.write(chunk)
+                written += len(chunk)
+        # Content-Length counts encoded bytes, so it can only be checked on unencoded responses
+        expected = r.headers.get("Content-Length")
+        if expected is not None and "Content-Encoding" not in r.headers and written != int(expected):
+            raise IOError(f"Truncated download of {url}: {written} of {expected} bytes")
+    return path
+
+def download_to_tempfile(url, suffix=""):
+    # Download a remote file to a temporary file on disk instead of buffering it in memory
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        pass
+    # A failed or interrupted download must not leave a partial archive behind
+    try:
+        return download_file(url, tmp.name)
+    except BaseException:
+        os.remove(tmp.name)
+        raise
+
+def disk_cache(cache_dir, ttl=7 * 24 * 3600, cacheable=None):
+    # Memoize a function in memory and on disk (gzip-compressed pickle keyed by a hash
+    # of its arguments), so repeated runs skip the network while the entry is fresh.
+    # ttl is in seconds; None means the cached entry never expires. cacheable, if given, is
+    # called on each result and a False return keeps that result out of both caches.
+    def decorator(func):
+        memo = {}
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            if args in memo:
+                return memo[args]
+            key = hashlib.sha1(repr(args).encode()).hexdigest()
+            path = os.path.join(cache_dir, f"{func.__name__}_{key}.pkl.gz")
+            if os.path.exists(path) and (ttl is None or time.time() - os.path.getmtime(path) < ttl):
+                try:
+                    with gzip.open(path, "rb") as f:
+                        memo[args] = pickle.load(f)
+                    return memo[args]
+                except Exception:
+                    pass  # Unreadable entry (e.g. a run killed mid-write): treated as a miss
+            result = func(*args)
+            if cacheable is not None and not cacheable(result):
+                return result
+            os.makedirs(cache_dir, exist_ok=True)
+            # Atomic replace: a killed run never leaves a truncated entry, and threads may write concurrently
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp, "wb") as f:
+                pickle.dump(result, f)
+            os.replace(tmp, path)
+            memo[args] = result
+            return result
+        return wrapper
+    return decorator
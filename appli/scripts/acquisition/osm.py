@@ -9,13 +9,20 @@ Usage : Script for acquiring and preprocessing OSM data for a specific departmen
 
 import os
 import requests
+import numpy as np
+import pandas as pd
+import shapely
 import geopandas as gpd
-from appli.scripts.acquisition.download_utils import load_config, print_status
+from appli.scripts.acquisition.download_utils import load_config, print_status, disk_cache
+
+# Persistent cache for department bounds and Overpass responses (kept between runs)
+OSM_CACHE_DIR = "appli/cache/osm"
 
 # Function to load the geometry of the department from a GeoJSON file
+@disk_cache(OSM_CACHE_DIR, ttl=None)
 def get_bbox_from_dept(dept_code):
     url = "https://raw.githubusercontent.com/gregoiredavid/france-geojson/master/departements-version-simplifiee.geojson"
-    france = gpd.read_file(url).to_crs("EPSG:4326")
+    france = gpd.read_file(url, engine="pyogrio", use_arrow=True).to_crs("EPSG:4326")
     dept = france[france["code"] == dept_code]
     if dept.empty:
         raise ValueError(f"Department {dept_code} not found.")
@@ -34,17 +41,26 @@ def build_overpass_query(bbox):
     query += ");\nout body;\n>;\nout skel qt;"
     return query
 
+# Overpass answers 200 with partial elements and a "runtime error" remark when a query times
+# out or runs out of memory: such responses must not be cached
+def overpass_complete(data):
+    return "runtime error" not in data.get("remark", "")
+
 # Function to send the query to the Overpass API and retrieve the data
+@disk_cache(OSM_CACHE_DIR, cacheable=overpass_complete)
 def fetch_osm_data(query):
     url = "https://overpass-api.de/api/interpreter"
     response = requests.post(url, data={"data": query})
     response.raise_for_status()
-    return response.json()
+    data = response.json()
+    if not overpass_complete(data):
+        print_status("Overpass response incomplete", "err", data["remark"])
+    return data
 
 # Function to convert Overpass data into GeoDataFrames grouped by tag
 def overpass_to_geodataframes_by_tag(data):
     elements = data.get("elements", [])
-    nodes = {el["id"]: el for el in elements if el["type"] == "node"}
+    nodes = {el["id"]: (el["lon"], el["lat"]) for el in elements if el["type"] == "node"}
 
     tag_keys = ["building", "shop", "office", "amenity", "leisure"]
     tags_to_keep = tag_keys + [
@@ -52,7 +68,16 @@ def overpass_to_geodataframes_by_tag(data):
         "building:roof:shape", "name", "operator"
     ]
 
-    grouped = {tag: [] for tag in tag_keys}
+    # Column-oriented buffers per tag: point coordinates, polygon ring coordinates
+    # (with one ring index per vertex) and one list per kept tag
+    grouped = {
+        tag: {
+            "point_rows": [], "point_x": [], "point_y": [],
+            "poly_rows": [], "ring_x": [], "ring_y": [], "ring_idx": [],
+            "props": {k: [] for k in tags_to_keep}, "n_rows": 0,
+        }
+        for tag in tag_keys
+    }
 
     for el in elements:
         if "tags" not in el:
@@ -60,34 +85,48 @@ def overpass_to_geodataframes_by_tag(data):
         tag_type = next((k for k in tag_keys if k in el["tags"]), None)
         if tag_type is None:
             continue
+        buf = grouped[tag_type]
+        row = buf["n_rows"]
 
         if el["type"] == "node":
-            geom = {"type": "Point", "coordinates": [el["lon"], el["lat"]]}
+            buf["point_rows"].append(row)
+            buf["point_x"].append(el["lon"])
+            buf["point_y"].append(el["lat"])
         elif el["type"] == "way":
-            coords = []
-            for node_id in el.get("nodes", []):
-                node = nodes.get(node_id)
-                if node:
-                    coords.append([node["lon"], node["lat"]])
-            if len(coords) < 3:
+            coords = [nodes[node_id] for node_id in el.get("nodes", []) if node_id in nodes]
+            if len(coords) < 3 or (len(coords) == 3 and coords[0] == coords[-1]):
                 continue
-            geom = {"type": "Polygon", "coordinates": [coords]}
+            ring = len(buf["poly_rows"])
+            buf["poly_rows"].append(row)
+            for lon, lat in coords:
+                buf["ring_x"].append(lon)
+                buf["ring_y"].append(lat)
+                buf["ring_idx"].append(ring)
         else:
             continue
 
-        filtered_tags = {k: v for k, v in el["tags"].items() if k in tags_to_keep}
-        feature = {
-            "type": "Feature",
-            "geometry": geom,
-            "properties": filtered_tags
-        }
-
-        grouped[tag_type].append(feature)
+        for k, values in buf["props"].items():
+            values.append(el["tags"].get(k))
+        buf["n_rows"] += 1
 
+    # Build all geometries of a tag in batch with the shapely vectorized constructors
     gdfs = {}
-    for tag, features in grouped.items():
-        if features:
-            gdfs[tag] = gpd.GeoDataFrame.from_features(features, crs="EPSG:4326")
+    for tag, buf in grouped.items():
+        if not buf["n_rows"]:
+            continue
+        geoms = np.empty(buf["n_rows"], dtype=object)
+        if buf["point_rows"]:
+            geoms[buf["point_rows"]] = shapely.points(
+                np.fromiter(buf["point_x"], float), np.fromiter(buf["point_y"], float)
+            )
+        if buf["poly_rows"]:
+            rings = shapely.linearrings(
+                np.fromiter(buf["ring_x"], float), np.fromiter(buf["ring_y"], float),
+                indices=np.fromiter(buf["ring_idx"], np.int64)
+            )
+            geoms[buf["poly_rows"]] = shapely.polygons(rings)
+        props = pd.DataFrame(buf["props"]).dropna(axis=1, how="all")
+        gdfs[tag] = gpd.GeoDataFrame(props, geometry=geoms, crs="EPSG:4326")
     return gdfs
 
 # Main function to download OSM data for a specific department
@@ -104,8 +143,8 @@ def download_osm():
     gdfs_by_tag = overpass_to_geodataframes_by_tag(data)
 
     for tag, gdf in gdfs_by_tag.items():
-        output_path = os.path.join(output_dir, f"{tag}.geojson")
-        gdf.to_file(output_path, driver="GeoJSON")
+        output_path = os.path.join(output_dir, f"{tag}.parquet")
+        gdf.to_parquet(output_path)
         print_status(f"File {tag}", "ok", f"{len(gdf)} objects")
 
     print_status("OSM data downloaded", "ok")
@@ -1,20 +1,20 @@
 """
 Script : recens.py
 Objective : Download and process INSEE Recens data (200m grid and Filosofi data),
-            filter by department, and export as GeoJSON.
+            filter by department, and export as GeoParquet.
 Author : LEDERMANN Quentin
 Date : June 2025
 Usage : Script for acquiring and preprocessing Recens data for a specific department.
 """
 
 import os
-import requests
 import py7zr
 import zipfile
 import geopandas as gpd
 import pandas as pd
+from pandas.api.types import union_categoricals
 import warnings
-from appli.scripts.acquisition.download_utils import print_status, load_config
+from appli.scripts.acquisition.download_utils import print_status, load_config, download_file
 
 # Suppress pyogrio warnings
 warnings.filterwarnings("ignore", category=RuntimeWarning, module="pyogrio")
@@ -25,20 +25,22 @@ URL_CSV = "https://www.insee.fr/fr/statistiques/fichier/7655475/Filosofi2019_car
 CACHE_DIR = "appli/cache"
 
 # Function to download and extract files from a given URL
-def download_and_extract(url, dest_dir):
+# (extraction is skipped when the expected extracted file is already in dest_dir)
+def download_and_extract(url, dest_dir, expected=None):
     filename = url.split("/")[-1]
     local_path = os.path.join(dest_dir, filename)
 
     # Download the file if it doesn't already exist
     if not os.path.exists(local_path):
-        r = requests.get(url, stream=True)
-        with open(local_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
+        download_file(url, local_path)
         print_status(f"Download completed: {filename}", "ok")
     else:
         print_status(f"{filename} already exists", "info")
 
+    if expected and os.path.exists(os.path.join(dest_dir, expected)):
+        print_status(f"{expected} already extracted", "info")
+        return
+
     # Extract the file based on its format
     try:
         if filename.endswith(".7z"):
@@ -85,35 +87,47 @@ def download_recens():
     os.makedirs("appli/data/recens", exist_ok=True)
 
     # Download and extract files
-    download_and_extract(URL_SHAPE, CACHE_DIR)
-    download_and_extract(URL_CSV, CACHE_DIR)
+    shp_name = "grille200m_metropole.shp"
+    csv_name = "carreaux_200m_met.csv"
+    download_and_extract(URL_SHAPE, CACHE_DIR, expected=shp_name)
+    download_and_extract(URL_CSV, CACHE_DIR, expected=csv_name)
 
-    # Extract all archives in the cache directory
-    extract_all_archives_in_cache(CACHE_DIR)
+    # Extract nested archives only if the expected files are still missing
+    if not all(os.path.exists(os.path.join(CACHE_DIR, name)) for name in (shp_name, csv_name)):
+        extract_all_archives_in_cache(CACHE_DIR)
 
     # Load data
     print_status("Loading data", "info")
-    gdf = gpd.read_file(os.path.join(CACHE_DIR, "grille200m_metropole.shp"))
-    df = pd.read_csv(os.path.join(CACHE_DIR, "carreaux_200m_met.csv"), sep=',', dtype=str)
+    csv_path = os.path.join(CACHE_DIR, csv_name)
 
     # Check for required columns
-    if "lcog_geo" not in df.columns:
+    if "lcog_geo" not in pd.read_csv(csv_path, sep=',', nrows=0).columns:
         print_status("Missing 'lcog_geo' column in the CSV", "err")
         return
 
+    # Stream the CSV by chunks and filter by department using lcog_geo
+    print_status(f"Filtering grid cells for department {dep_code}", "info")
+    chunks = pd.read_csv(csv_path, sep=',', dtype=str, chunksize=500_000)
+    df = pd.concat(chunk[chunk["lcog_geo"].str.startswith(dep_code, na=False)] for chunk in chunks)
+
+    # Keep only the grid cells of the department before the join
+    gdf = gpd.read_file(os.path.join(CACHE_DIR, shp_name), engine="pyogrio", use_arrow=True)
+    gdf = gdf[gdf["idINSPIRE"].isin(df["idcar_200m"])]
+
     # Perform attribute join
     print_status("Performing attribute join", "info")
     gdf = gdf.rename(columns={"idINSPIRE": "id_car200m"})
     df = df.rename(columns={"idcar_200m": "id_car200m"})
-    gdf_joined = gdf.merge(df, on="id_car200m", how="inner")
-
-    # Filter by department using lcog_geo
-    print_status(f"Filtering grid cells for department {dep_code}", "info")
-    gdf_filtered = gdf_joined[gdf_joined["lcog_geo"].str.startswith(dep_code)]
+    # Shared categories on the key so the merge hashes integer codes instead of strings
+    cat = union_categoricals([gdf["id_car200m"].astype("category"), df["id_car200m"].astype("category")])
+    gdf["id_car200m"] = pd.Categorical(gdf["id_car200m"], categories=cat.categories)
+    df["id_car200m"] = pd.Categorical(df["id_car200m"], categories=cat.categories)
+    gdf_filtered = gdf.merge(df, on="id_car200m", how="inner")
+    gdf_filtered["id_car200m"] = gdf_filtered["id_car200m"].astype(str)
 
     # Save the filtered data
-    output_path = os.path.join("appli/data/recens", f"recens_{dep_code}.geojson")
-    gdf_filtered.to_file(output_path, driver="GeoJSON")
+    output_path = os.path.join("appli/data/recens", f"recens_{dep_code}.parquet")
+    gdf_filtered.to_parquet(output_path)
     print_status(f"File saved: {output_path}", "ok")
 
 # Entry point
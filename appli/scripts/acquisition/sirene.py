@@ -1,6 +1,6 @@
 """
 Script : sirene.py
-Objective : Download the SIRENE dataset from INSEE, filter by department, and convert it to GeoJSON format.
+Objective : Download the SIRENE dataset from INSEE, filter by department, and convert it to GeoParquet format.
 Author : LEDERMANN Quentin
 Date : June 2025
 Usage : Script for acquiring and preprocessing SIRENE data for a specific department.
@@ -11,33 +11,64 @@ import pandas as pd
 import requests
 import geopandas as gpd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pac
 from zipfile import ZipFile
-from io import BytesIO
-from appli.scripts.acquisition.download_utils import load_config, print_status
+from appli.scripts.acquisition.download_utils import load_config, print_status, download_to_tempfile
 
-# Function to download the SIRENE dataset from INSEE, filter by department, and convert to GeoJSON
+# Columns of the SIRENE stock file used downstream (all other columns are skipped at parse time)
+SIRENE_COLUMNS = [
+    "siret",
+    "codePostalEtablissement",
+    "activitePrincipaleEtablissement",
+    "trancheEffectifsEtablissement",
+    "coordonneeLambertAbscisseEtablissement",
+    "coordonneeLambertOrdonneeEtablissement",
+]
+
+# Function to download the SIRENE dataset from INSEE, filter by department, and convert to GeoParquet
 def download_sirene():
     # Load configuration to get the department number
     config = load_config()
     departement = config["departement"]
     url = "https://www.data.gouv.fr/fr/datasets/r/0651fb76-bcf3-4f6a-a38d-bc04fa708576"
-    output_geojson = f"appli/data/sirene/sirene.geojson"
+    output_path = "appli/data/sirene/sirene.parquet"
     os.makedirs("appli/data/sirene", exist_ok=True)
 
     # Download the SIRENE ZIP file
     print_status("Downloading SIRENE", "info")
-    r = requests.get(url)
-    if r.status_code != 200:
-        print_status("Downloading SIRENE", "err", f"HTTP Code {r.status_code}")
+    try:
+        zip_path = download_to_tempfile(url, suffix=".zip")
+    except requests.HTTPError as e:
+        print_status("Downloading SIRENE", "err", f"HTTP Code {e.response.status_code}")
+        return
+    except (requests.RequestException, IOError) as e:
+        print_status("Downloading SIRENE", "err", str(e))
         return
 
-    # Extract the ZIP file and filter by department
-    with ZipFile(BytesIO(r.content)) as z:
-        with z.open("StockEtablissement_utf8.csv") as csv_file:
-            chunks = pd.read_csv(csv_file, sep=",", dtype=str, chunksize=100000)
-            df = pd.concat(chunk[chunk["codePostalEtablissement"].str.startswith(departement, na=False)] for chunk in chunks)
+    # Stream the CSV out of the ZIP file with Arrow, keeping only the required columns,
+    # and filter each block by department before anything is converted to pandas
+    try:
+        with ZipFile(zip_path) as z:
+            with z.open("StockEtablissement_utf8.csv") as csv_file:
+                reader = pac.open_csv(
+                    csv_file,
+                    read_options=pac.ReadOptions(block_size=64 << 20, use_threads=True),
+                    convert_options=pac.ConvertOptions(
+                        include_columns=SIRENE_COLUMNS,
+                        column_types={col: pa.string() for col in SIRENE_COLUMNS},
+                    ),
+                )
+                batches = [
+                    batch.filter(pc.starts_with(batch["codePostalEtablissement"], departement))
+                    for batch in reader
+                ]
+                df = pa.Table.from_batches(batches, schema=reader.schema).to_pandas()
+    finally:
+        os.remove(zip_path)
 
-    # Process and convert to GeoJSON
+    # Process and convert to GeoParquet
     try:
         df["longitude"] = pd.to_numeric(df["coordonneeLambertAbscisseEtablissement"], errors="coerce")
         df["latitude"] = pd.to_numeric(df["coordonneeLambertOrdonneeEtablissement"], errors="coerce")
@@ -48,10 +79,14 @@ def download_sirene():
             geometry=gpd.points_from_xy(df_geo["longitude"], df_geo["latitude"]),
             crs="EPSG:4326"
         ).to_crs("EPSG:2154")
-        gdf.to_file(output_geojson, driver="GeoJSON")  # Save as GeoJSON
+        # Precompute the NAF division and sort on it so that row-group statistics let readers
+        # skip the row groups of other activities (e.g. retail trade, naf2 == "47")
+        gdf["naf2"] = gdf["activitePrincipaleEtablissement"].str.slice(0, 2)
+        gdf = gdf.sort_values("naf2", kind="stable")
+        gdf.to_parquet(output_path, row_group_size=200_000)  # Save as GeoParquet
         print_status("SIRENE downloaded and converted", "ok")
     except Exception as e:
-        print_status("SIRENE GeoJSON conversion failed", "err", str(e))
+        print_status("SIRENE GeoParquet conversion failed", "err", str(e))
 
 # Entry point
 if __name__ == "__main__":
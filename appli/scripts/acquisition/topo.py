@@ -7,18 +7,23 @@ Date : June 2025
 Usage : Script for acquiring and preprocessing BD TOPO data for a specific department.
 """
 
+import functools
 import os
-import requests
 import yaml
 import py7zr
-from io import BytesIO
 import shutil
-from appli.scripts.acquisition.download_utils import load_config, print_status
+from pathlib import Path
+from appli.scripts.acquisition.download_utils import load_config, print_status, download_to_tempfile
+
+# Function to load the BD TOPO URLs configuration (parsed once per process)
+@functools.lru_cache(maxsize=None)
+def load_topo_urls(path="appli/config/topo_url.yaml"):
+    with open(path, "r") as f:
+        return yaml.safe_load(f)
 
 # Function to retrieve the BD TOPO URL from the configuration file
 def get_topo_url():
-    with open("appli/config/topo_url.yaml", "r") as f:
-        topo_config = yaml.safe_load(f)
+    topo_config = load_topo_urls()
     departement = load_config()["departement"]
     return topo_config["topo_url"].get(f"{departement}_url")
 
@@ -29,7 +34,7 @@ def download_topo():
         print_status("BD TOPO", "err", "Missing URL in topo_url.yaml")
         return
 
-    extract_root = "appli/cache"
+    extract_root = "appli/cache/topo"  # Dedicated folder: appli/cache is shared with the census download
     output_dir = "appli/data/topo"
     os.makedirs(extract_root, exist_ok=True)
     os.makedirs(output_dir, exist_ok=True)
@@ -37,26 +42,27 @@ def download_topo():
     try:
         # Download the BD TOPO archive
         print_status("Downloading BD TOPO", "info")
-        r = requests.get(url)
-        if r.status_code != 200:
-            raise Exception(f"HTTP Code {r.status_code}")
-        with py7zr.SevenZipFile(BytesIO(r.content)) as archive:
-            archive.extractall(path=extract_root)
+        archive_path = download_to_tempfile(url, suffix=".7z")
+        try:
+            with py7zr.SevenZipFile(archive_path, mode="r") as archive:
+                archive.extractall(path=extract_root)
+        finally:
+            os.remove(archive_path)
         print_status("BD TOPO extraction successful", "ok")
 
-        # Search for BATIMENT and TRONCON_DE_ROUTE files in the extracted directory
-        found = False
-        for root, dirs, files in os.walk(extract_root):
-            for file in files:
-                name, _ = os.path.splitext(file)
-                if name.upper() == "BATIMENT" and name.upper() == "TRONCON_DE_ROUTE":
-                    src = os.path.join(root, file)
-                    dst = os.path.join(output_dir, file)
-                    shutil.copy2(src, dst)
-                    found = True
+        # Search for BATIMENT and TRONCON_DE_ROUTE files (all shapefile components) in the extracted directory
+        targets = {"BATIMENT", "TRONCON_DE_ROUTE"}
+        copied = set()
+        for path in Path(extract_root).rglob("*"):
+            if path.is_file() and path.stem.upper() in targets:
+                shutil.copy2(path, os.path.join(output_dir, path.name))
+                copied.add(path.stem.upper())
+        found = bool(copied)
 
         if found:
             print_status("BATIMENT and TRONCON_DE_ROUTE files extracted", "ok")
+            if copied != targets:
+                print_status("Missing BD TOPO layer", "err", ", ".join(sorted(targets - copied)))
         else:
             print_status("No BATIMENT or TRONCON_DE_ROUTE files found", "err")
 
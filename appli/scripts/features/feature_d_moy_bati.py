@@ -9,42 +9,57 @@ Usage : Script for generating spatial features related to building distances.
 import geopandas as gpd  
 import pandas as pd      
 import numpy as np       
-from scipy.spatial.distance import pdist  
-from appli.scripts.features.features_utils import load_config, print_status  
+import shapely
+from numba import njit, prange
+from appli.scripts.features.features_utils import load_config, print_status, query_grid, load_topo, load_grid, write_table
+
+# Mean pairwise distance of the points of each group, groups being the slices
+# [starts[g], starts[g + 1]) of the sorted coordinate arrays (NaN below two points)
+@njit(parallel=True, cache=True)
+def mean_pdist_per_group(starts, gx, gy):
+    n_groups = len(starts) - 1
+    out = np.empty(n_groups)
+    for g in prange(n_groups):
+        lo = starts[g]
+        hi = starts[g + 1]
+        n = hi - lo
+        if n < 2:
+            out[g] = np.nan
+            continue
+        total = 0.0
+        for i in range(lo, hi):
+            for j in range(i + 1, hi):
+                dx = gx[i] - gx[j]
+                dy = gy[i] - gy[j]
+                total += np.sqrt(dx * dx + dy * dy)
+        out[g] = total / (n * (n - 1) / 2)
+    return out
 
 def compute_distance_moyenne_batiments(grid: gpd.GeoDataFrame) -> pd.DataFrame:
     try:
-        config = load_config()  # Load project configuration
-        departement = config["departement"]
-        path_bati = "appli/data/topo/BATIMENT.shp"  # Path to the building file
+        # Load building geometries (reprojected to EPSG:2154) and keep only polygons
+        bati = load_topo("BATIMENT", columns=[], bbox=tuple(grid.total_bounds))  # Only buildings within the grid extent
+        bati = bati[shapely.get_type_id(bati.geometry.values) == shapely.GeometryType.POLYGON]
+        # Compute building centroids in one vectorized call and keep their coordinates as float arrays
+        centroids = shapely.centroid(bati.geometry.values)
+        bati = gpd.GeoDataFrame({"cx": shapely.get_x(centroids), "cy": shapely.get_y(centroids)}, geometry=centroids, crs="EPSG:2154")
 
-        # Load buildings and reproject to EPSG:2154
-        bati = gpd.read_file(path_bati).to_crs("EPSG:2154")
-        # Keep only polygons (buildings)
-        bati = bati[bati.geometry.type == "Polygon"]
-        # Compute the centroid of each building
-        bati["centroid"] = bati.geometry.centroid
-        # Replace geometry with centroid for spatial join
-        bati = gpd.GeoDataFrame(bati, geometry="centroid", crs="EPSG:2154")
+        # Spatial query on the grid index: associate each building with a grid cell
+        bati_idx, cell_idx = query_grid(grid, bati.geometry.values, predicate="within")
 
-        # Spatial join: associate each building with a grid cell
-        joined = gpd.sjoin(bati, grid, how="inner", predicate="within")
+        # Take the centroid coordinates of the matched buildings and sort them by grid cell
+        gx = bati["cx"].to_numpy()[bati_idx]
+        gy = bati["cy"].to_numpy()[bati_idx]
+        order = np.argsort(cell_idx, kind="stable")
+        cells, starts = np.unique(cell_idx[order], return_index=True)
+        starts = np.append(starts, len(order))
 
-        # Compute average distances between buildings for each grid cell
-        results = []
-        for id_, group in joined.groupby("idINSPIRE"):
-            # Retrieve coordinates of building centroids within the grid cell
-            coords = np.array([[pt.x, pt.y] for pt in group.geometry])
-            if len(coords) > 1:
-                # Compute the average distance between all buildings in the grid cell
-                dist = pdist(coords).mean()
-                results.append((id_, dist))
-            else:
-                # If only one building, distance is undefined (NaN)
-                results.append((id_, np.nan))
+        # Compute the average distance between all buildings of each grid cell
+        # (undefined, i.e. NaN, when the cell contains a single building)
+        dist = mean_pdist_per_group(starts, gx[order], gy[order])
 
         # Create a DataFrame with the results
-        df = pd.DataFrame(results, columns=["idINSPIRE", "distance_moyenne_batiments"])
+        df = pd.DataFrame({"idINSPIRE": grid["idINSPIRE"].to_numpy()[cells], "distance_moyenne_batiments": dist})
         return df
 
     except Exception as e:
@@ -55,17 +70,14 @@ def compute_distance_moyenne_batiments(grid: gpd.GeoDataFrame) -> pd.DataFrame:
 if __name__ == "__main__":
     config = load_config()  # Load project configuration
     maillage = config["maillage"]
-    departement = config["departement"]
-    # Path to the spatial grid
-    grid_path = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
-    # Load the grid and reproject to EPSG:2154
-    grid = gpd.read_file(grid_path).to_crs("EPSG:2154")
+    # Load the grid (shared EPSG:2154 GeoParquet copy)
+    grid = load_grid()
 
     print_status("Computing average building distances", "info")
     # Compute the average distance between buildings for each grid cell
     result = compute_distance_moyenne_batiments(grid)
-    # Path to the output CSV file
-    output_path = f"appli/output/features/distance_moyenne_batiments_{maillage}m.csv"
+    # Path to the output file (extension added according to output_format)
+    output_path = f"appli/output/features/distance_moyenne_batiments_{maillage}m"
     # Export the results
-    result.to_csv(output_path, index=False)
+    output_path = write_table(result, output_path)
     print_status("Average building distances exported", "ok", output_path)
@@ -7,50 +7,54 @@ Usage : Script for generating spatial features related to shop density.
 """
 
 import pandas as pd 
-import geopandas as gpd 
+import numpy as np
 import os  
-from appli.scripts.features.features_utils import load_config, print_status  
-from shapely.geometry import Point  
+import shapely
+import pyarrow.dataset as ds
+from appli.scripts.features.features_utils import load_config, print_status, get_grid_and_tree, write_table
 
 def compute_densite_commerces():
     config = load_config()  # Load project configuration
-    departement = config["departement"]
     maillage = config["maillage"]
 
     # Define input and output file paths
-    grid_path = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
     surf_path = f"appli/data/features/surf_batie_{maillage}m.csv"
-    sirene_path = "appli/data/sirene/sirene.geojson"
-    out_path = f"appli/output/features/densite_commerces_{maillage}m.csv"
+    sirene_path = "appli/data/sirene/sirene.parquet"
+    out_path = f"appli/output/features/densite_commerces_{maillage}m"
 
     print_status("Loading files", "info")
-    # Load spatial grid, built surface area, and SIRENE establishments
-    grid = gpd.read_file(grid_path).to_crs("EPSG:2154")
+    # Load spatial grid and built surface area
+    grid, tree = get_grid_and_tree()
     surf = pd.read_csv(surf_path)
-    sirene = gpd.read_file(sirene_path).to_crs("EPSG:2154")
 
     # Harmonize the type of the join key
-    grid["idINSPIRE"] = grid["idINSPIRE"].astype(str)
     surf["idINSPIRE"] = surf["idINSPIRE"].astype(str)
 
-    # Reconstruct the geometry of establishments if missing or empty
-    if "geometry" not in sirene.columns or sirene.geometry.is_empty.any():
-        sirene["geometry"] = sirene.apply(lambda row: Point(row["longitude"], row["latitude"]), axis=1)
-        sirene = gpd.GeoDataFrame(sirene, geometry="geometry", crs="EPSG:2154")
-
-    # Filter retail shops based on NAF code (47 = retail trade)
-    sirene["naf2"] = sirene["activitePrincipaleEtablissement"].astype(str).str[:2]
-    commerces = sirene[sirene["naf2"] == "47"]
-
     print_status("Joining shops → grid cells", "info")
-    # Spatial join to count the number of shops per grid cell
-    joint = gpd.sjoin(grid, commerces, how="left", predicate="contains")
-    count = joint.groupby("idINSPIRE").size().reset_index(name="nb_commerces")
-    count["idINSPIRE"] = count["idINSPIRE"].astype(str)
+    # Stream the retail shops (NAF code 47 = retail trade, filter pushed down to the Parquet reader)
+    # by batches, and accumulate the number of shops per grid cell with the shared grid index,
+    # so peak memory does not depend on the size of the SIRENE file
+    nb_commerces = np.zeros(len(grid), dtype=np.int64)
+    batches = ds.dataset(sirene_path).to_batches(
+        columns=["longitude", "latitude"], filter=ds.field("naf2") == "47", batch_size=500_000
+    )
+    for batch in batches:
+        # Coordinates are stored as finite Lambert floats by the SIRENE acquisition step
+        points = shapely.points(
+            batch["longitude"].to_numpy(zero_copy_only=False),
+            batch["latitude"].to_numpy(zero_copy_only=False),
+        )
+        _, cell_idx = tree.query(points, predicate="within")
+        nb_commerces += np.bincount(cell_idx, minlength=len(grid))
+
+    count = pd.DataFrame({
+        "idINSPIRE": grid["idINSPIRE"].astype(str).to_numpy(),  # the shared grid is left untouched
+        "nb_commerces": nb_commerces,
+    })
 
     print_status("Calculating density", "info")
     # Merge the number of shops and built surface area for each grid cell
-    merged = grid[["idINSPIRE"]].merge(count, on="idINSPIRE", how="left").merge(surf, on="idINSPIRE", how="left")
+    merged = count.merge(surf, on="idINSPIRE", how="left")
     merged = merged.fillna(0)  # Replace missing values with 0
 
     # Apply a minimum surface threshold to avoid outliers
@@ -60,7 +64,7 @@ def compute_densite_commerces():
     merged["densite_commerces"] = merged["nb_commerces"] / merged["surf_batie"]
 
     # Export the final result (grid cell ID + shop density)
-    merged[["idINSPIRE", "densite_commerces"]].to_csv(out_path, index=False)
+    out_path = write_table(merged[["idINSPIRE", "densite_commerces"]], out_path)
     print_status("Export completed", "ok", out_path)
 
 # Entry point
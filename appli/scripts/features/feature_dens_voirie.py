@@ -1,81 +1,68 @@
 """
 Script : dens_voirie.py
-Objective : Compute the road density (in km/km²) within each 200m grid cell,
+Objective : Compute the road density (in km/km²) within each grid cell,
             based on the linear road layer.
 Author : LEDERMANN Quentin
 Date : June 2025
 Usage : Feature generation step in the feature pipeline.
 """
 
-import geopandas as gpd
 import pandas as pd
+import shapely
 import os
-from appli.scripts.features.features_utils import print_status,load_config
-
-config = load_config()
-departement = config["departement"]
-maillage = config["maillage"]
+from appli.scripts.features.features_utils import print_status, load_config, query_grid, load_topo, load_grid, write_table
 
 # === SCRIPT PARAMETERS ===
 PATH_ROUTE = "appli/data/topo/TRONCON_DE_ROUTE.shp"
-GRID_PATH = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
-OUTPUT_PATH = f"appli/output/features/densite_voirie_{maillage}m.csv"
-MAILLE_SURFACE_KM2 = 0.04  # surface of a 200m x 200m grid cell in km²
 
 # Main function for optimized road density calculation
 def compute_densite_voirie_optimisee():
 
     config = load_config()
-    departement = config["departement"]
     maillage = config["maillage"]
+    # Surface of a grid cell in km², the same for every cell of the regular grid
+    maille_surface_km2 = (int(maillage) / 1000) ** 2
 
     try:
         if not os.path.exists(PATH_ROUTE):
             print_status("TRONCON_DE_ROUTE.shp file not found", "err", PATH_ROUTE)
             return
 
-        if not os.path.exists(GRID_PATH):
-            print_status("Grid file not found", "err", GRID_PATH)
-            return
-
         print_status("Loading data...", "info")
-        voirie = gpd.read_file(PATH_ROUTE).to_crs("EPSG:2154")
-        grid = gpd.read_file(GRID_PATH).to_crs("EPSG:2154")
-
-        # Spatial filtering using bounding box
-        print_status("Spatial filtering by bounding box...", "info")
-        bbox = grid.total_bounds
-        voirie = voirie.cx[bbox[0]:bbox[2], bbox[1]:bbox[3]]
+        grid = load_grid()
+        voirie = load_topo("TRONCON_DE_ROUTE", columns=[], bbox=tuple(grid.total_bounds))  # Road geometries within the grid extent
 
         # Compute road lengths (in km)
         print_status("Computing road lengths...", "info")
-        voirie["longueur_km"] = voirie.geometry.length / 1000
-        grid["surface_km2"] = grid.geometry.area / 1e6
+        voirie["longueur_km"] = shapely.length(voirie.geometry.values) / 1000
 
-        # Spatial join: roads → grid cells
+        # Spatial query on the grid index: road / grid cell pairs that intersect
         print_status("Spatial join between roads and grid...", "info")
-        voirie = voirie.drop(columns=['index_right'], errors='ignore')
-        grid = grid.drop(columns=['index_right'], errors='ignore')
-        joined = gpd.sjoin(voirie, grid, how="inner", predicate="intersects")
-        joined = joined.rename(columns={"geometry": "geometry_voirie", "index_right": "grid_index"})
+        voirie_idx, grid_idx = query_grid(grid, voirie.geometry.values, predicate="intersects")
 
         # Compute exact intersections between roads and grid cells
+        # (element-wise in a single GEOS call on the aligned road / grid cell geometry arrays).
+        # Roads lying wholly inside their cell keep their full length and are not clipped.
         print_status("Computing geometric intersections...", "info")
-        joined["geometry"] = joined.apply(
-            lambda row: row["geometry_voirie"].intersection(grid.iloc[row["grid_index"]].geometry),
-            axis=1
-        )
-        joined["longueur_intersect_km"] = joined.geometry.length / 1000
-        joined["idINSPIRE"] = grid.iloc[joined["grid_index"]]["idINSPIRE"].values
-
-        # Aggregate by grid cell
+        routes = voirie.geometry.values.take(voirie_idx)
+        cellules = grid.geometry.values.take(grid_idx)
+        longueur = voirie["longueur_km"].to_numpy().take(voirie_idx)
+        coupees = ~shapely.contains(cellules, routes)
+        longueur[coupees] = shapely.length(shapely.intersection(routes[coupees], cellules[coupees])) / 1000.0
+        joined = pd.DataFrame({"grid_idx": grid_idx, "longueur_intersect_km": longueur})
+
+        # Aggregate by grid cell (integer position in the grid)
         print_status("Aggregating by grid cell...", "info")
-        result = joined.groupby("idINSPIRE")["longueur_intersect_km"].sum().reset_index()
-        result["densite_voirie"] = result["longueur_intersect_km"] / MAILLE_SURFACE_KM2
+        result = joined.groupby("grid_idx")["longueur_intersect_km"].sum()
+        result = pd.DataFrame({
+            "idINSPIRE": grid["idINSPIRE"].to_numpy().take(result.index.to_numpy()),
+            "longueur_intersect_km": result.to_numpy(),
+        })
+        result["densite_voirie"] = result["longueur_intersect_km"] / maille_surface_km2
 
         # Export results
-        result.to_csv(OUTPUT_PATH, index=False)
-        print_status("Road density successfully exported", "ok", OUTPUT_PATH)
+        output_path = write_table(result, f"appli/output/features/densite_voirie_{maillage}m")
+        print_status("Road density successfully exported", "ok", output_path)
 
     except Exception as e:
         print_status(f"Error during optimized calculation: {str(e)}", "err")
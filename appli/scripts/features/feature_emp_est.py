@@ -9,28 +9,23 @@ Usage : Script for generating spatial features related to job estimation.
 
 import geopandas as gpd
 import pandas as pd
+import numpy as np
+import shapely
 import os
-from appli.scripts.features.features_utils import load_config, print_status
+from appli.scripts.features.features_utils import load_config, print_status, query_grid, load_grid, write_table
 
 def compute_emplois_estimes_pondere(grid: gpd.GeoDataFrame) -> pd.DataFrame:
     try:
-        config = load_config()  # Load project configuration
-        departement = config["departement"]
-        path = f"appli/data/sirene/sirene.geojson"
+        path = "appli/data/sirene/sirene.parquet"
 
         # Check if the SIRENE file exists
         if not os.path.exists(path):
             print_status("SIRENE file not found", "err")
             return pd.DataFrame(columns=["idINSPIRE", "emplois_estimes_pondere"])
 
-        gdf = gpd.read_file(path)
-
-        # Reconstruct geometry from Lambert coordinates if geometry is null
-        gdf["x"] = pd.to_numeric(gdf["longitude"], errors="coerce")
-        gdf["y"] = pd.to_numeric(gdf["latitude"], errors="coerce")
-        gdf = gdf.dropna(subset=["x", "y"])
-        gdf["geometry"] = gpd.points_from_xy(gdf["x"], gdf["y"])
-        gdf = gpd.GeoDataFrame(gdf, geometry="geometry", crs="EPSG:2154")
+        gdf = pd.read_parquet(path, columns=[
+            "longitude", "latitude", "trancheEffectifsEtablissement", "naf2"
+        ])
 
         # Dictionary mapping tranche codes to average employee counts
         TRANCHE_TO_EFFECTIF = {
@@ -40,23 +35,21 @@ def compute_emplois_estimes_pondere(grid: gpd.GeoDataFrame) -> pd.DataFrame:
         }
 
         gdf["tranche"] = gdf["trancheEffectifsEtablissement"].map(TRANCHE_TO_EFFECTIF)
-        gdf["naf2"] = gdf["activitePrincipaleEtablissement"].astype(str).str[:2]
-
         # Compute fallback average employee counts by NAF code
         naf_fallback = gdf.dropna(subset=["tranche"]).groupby("naf2")["tranche"].mean()
 
         # Estimate the number of employees for each establishment
-        gdf["emplois_estimes"] = gdf.apply(
-            lambda row: row["tranche"]
-            if pd.notnull(row["tranche"])
-            else naf_fallback.get(row["naf2"], 0),
-            axis=1
+        # (known tranche, else the average of the NAF division, else 0)
+        gdf["emplois_estimes"] = (
+            gdf["tranche"].fillna(gdf["naf2"].map(naf_fallback)).fillna(0.0).astype("float32")
         )
 
-        # Spatial join: assign establishments to grid cells
-        joined = gpd.sjoin(grid, gdf[["geometry", "emplois_estimes"]], how="left", predicate="contains")
-        emplois = joined.groupby("idINSPIRE")["emplois_estimes"].sum().reset_index()
-        emplois.rename(columns={"emplois_estimes": "emplois_estimes_pondere"}, inplace=True)
+        # Spatial query on the grid index: assign establishments (points built from their
+        # Lambert coordinates) to grid cells, and sum the estimated jobs of each cell
+        points = shapely.points(gdf["longitude"].to_numpy(dtype=float), gdf["latitude"].to_numpy(dtype=float))
+        pts_idx, cell_idx = query_grid(grid, points, predicate="within")
+        emplois_sum = np.bincount(cell_idx, weights=gdf["emplois_estimes"].to_numpy()[pts_idx], minlength=len(grid))
+        emplois = pd.DataFrame({"idINSPIRE": grid["idINSPIRE"].to_numpy(), "emplois_estimes_pondere": emplois_sum})
 
         return emplois
 
@@ -68,12 +61,10 @@ def compute_emplois_estimes_pondere(grid: gpd.GeoDataFrame) -> pd.DataFrame:
 if __name__ == "__main__":
     config = load_config()  # Load project configuration
     maillage = config["maillage"]
-    departement = config["departement"]
-    grid_path = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
-    grid = gpd.read_file(grid_path).to_crs("EPSG:2154")
+    grid = load_grid()
 
     print_status("Computing weighted job estimates", "info")
     result = compute_emplois_estimes_pondere(grid)
-    output_path = f"appli/output/features/emplois_estimes_pondere_{maillage}m.csv"
-    result.to_csv(output_path, index=False)
+    output_path = f"appli/output/features/emplois_estimes_pondere_{maillage}m"
+    output_path = write_table(result, output_path)
     print_status("Job estimates exported", "ok", output_path)
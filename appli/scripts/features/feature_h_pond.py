@@ -8,14 +8,14 @@ Usage : Script for generating spatial features related to building heights.
 
 import geopandas as gpd
 import pandas as pd
+import shapely
+import pyarrow.compute as pc
 import os
 import numpy as np
-from appli.scripts.features.features_utils import load_config, print_status
+from appli.scripts.features.features_utils import load_config, print_status, query_grid, load_topo, weighted_sums, to_float32, load_grid, write_table
 
 def compute_hauteur_ponderee_surface(grid: gpd.GeoDataFrame) -> pd.DataFrame:
     try:
-        config = load_config()  # Load project configuration
-        departement = config["departement"]
         path_bati = "appli/data/topo/BATIMENT.shp"
 
         # Check if the building file exists
@@ -23,29 +23,30 @@ def compute_hauteur_ponderee_surface(grid: gpd.GeoDataFrame) -> pd.DataFrame:
             print_status("BATIMENT.shp file not found", "err", path_bati)
             return pd.DataFrame(columns=["idINSPIRE", "hauteur_ponderee_surface"])
 
-        # Load buildings and grid
-        bati = gpd.read_file(path_bati).to_crs("EPSG:2154")
-        bati = bati[bati.geometry.type == "Polygon"]  # Keep only polygons (buildings)
-        bati = bati[bati["HAUTEUR"].notna()]  # Filter buildings with valid height data
+        # Load buildings with a height within the grid extent (other buildings are dropped by the
+        # Parquet reader, before decoding their geometry)
+        bati = load_topo("BATIMENT", columns=["HAUTEUR"], bbox=tuple(grid.total_bounds), filters=pc.field("HAUTEUR").is_valid())
 
-        # Compute surface area
-        bati["area"] = bati.geometry.area
-        bati["hauteur"] = pd.to_numeric(bati["HAUTEUR"], errors="coerce")
+        # Compute surface area and height (float32 is enough for the sums, the final division is done in float64)
+        area = shapely.area(bati.geometry.values).astype(np.float32)
+        hauteur = to_float32(bati["HAUTEUR"])
 
-        # Remove invalid cases
-        bati = bati.dropna(subset=["hauteur", "area"])
-        bati = bati[bati["area"] > 0]
+        # Keep polygons (buildings) with a valid height and a positive area, in a single indexing pass
+        ok = (shapely.get_type_id(bati.geometry.values) == shapely.GeometryType.POLYGON) & np.isfinite(hauteur) & (area > 0)
+        bati = bati[ok].assign(area=area[ok], hauteur=hauteur[ok])
 
-        # Spatial join with the grid
-        joined = gpd.sjoin(bati, grid, how="inner", predicate="intersects")
+        # Spatial query on the grid index: building / grid cell pairs that intersect
+        bati_idx, cell_idx = query_grid(grid, bati.geometry.values, predicate="intersects")
 
-        # Weighted height = sum(H * A) / sum(A)
-        joined["prod"] = joined["hauteur"] * joined["area"]
-        grouped = joined.groupby("idINSPIRE").agg(
-            somme_ponderee=("prod", "sum"),
-            somme_surface=("area", "sum")
-        ).reset_index()
-        grouped["hauteur_ponderee_surface"] = grouped["somme_ponderee"] / grouped["somme_surface"]
+        # Weighted height = sum(H * A) / sum(A), accumulated per grid cell position
+        num, den = weighted_sums(
+            cell_idx, bati["hauteur"].to_numpy().take(bati_idx), bati["area"].to_numpy().take(bati_idx), len(grid)
+        )
+        cells = np.unique(cell_idx)
+        grouped = pd.DataFrame({
+            "idINSPIRE": grid["idINSPIRE"].to_numpy().take(cells),
+            "hauteur_ponderee_surface": num[cells] / den[cells],
+        })
 
         return grouped[["idINSPIRE", "hauteur_ponderee_surface"]]
 
@@ -57,12 +58,10 @@ def compute_hauteur_ponderee_surface(grid: gpd.GeoDataFrame) -> pd.DataFrame:
 if __name__ == "__main__":
     config = load_config()  # Load project configuration
     maillage = config["maillage"]
-    departement = config["departement"]
-    grid_path = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
-    grid = gpd.read_file(grid_path).to_crs("EPSG:2154")
+    grid = load_grid()
 
     print_status("Computing height weighted by surface area", "info")
     result = compute_hauteur_ponderee_surface(grid)
-    output_path = f"appli/output/features/hauteur_ponderee_surface_{maillage}m.csv"
-    result.to_csv(output_path, index=False)
+    output_path = f"appli/output/features/hauteur_ponderee_surface_{maillage}m"
+    output_path = write_table(result, output_path)
     print_status("Weighted height exported", "ok", output_path)
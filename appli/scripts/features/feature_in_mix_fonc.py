@@ -10,8 +10,9 @@ Usage : Script for generating spatial features related to functional diversity.
 import geopandas as gpd
 import pandas as pd
 import numpy as np
+import shapely
 import os
-from appli.scripts.features.features_utils import load_config, print_status
+from appli.scripts.features.features_utils import load_config, print_status, query_grid, load_grid, write_table
 
 # Group NAF level 2 codes into major urban functions
 NAF2_TO_FONCTION = {
@@ -58,37 +59,38 @@ NAF2_TO_FONCTION = {
 
 def compute_indice_mixite_fonctionnelle(grid: gpd.GeoDataFrame) -> pd.DataFrame:
     try:
-        config = load_config()  # Load project configuration
-        departement = config["departement"]
-        path_sirene = f"appli/data/sirene/sirene.geojson"
+        path_sirene = "appli/data/sirene/sirene.parquet"
 
         # Check if the SIRENE file exists
         if not os.path.exists(path_sirene):
             print_status("SIRENE file missing", "err", path_sirene)
             return pd.DataFrame(columns=["idINSPIRE", "indice_mixite_fonctionnelle"])
 
-        # Load SIRENE data and reconstruct geometry
-        gdf = gpd.read_file(path_sirene)
-        gdf["x"] = pd.to_numeric(gdf["longitude"], errors="coerce")
-        gdf["y"] = pd.to_numeric(gdf["latitude"], errors="coerce")
-        gdf = gdf.dropna(subset=["x", "y"])
-        gdf["geometry"] = gpd.points_from_xy(gdf["x"], gdf["y"])
-        gdf = gpd.GeoDataFrame(gdf, geometry="geometry", crs="EPSG:2154")
+        # Load SIRENE data (Lambert coordinates and NAF division)
+        gdf = pd.read_parquet(path_sirene, columns=["longitude", "latitude", "naf2"])
 
-        # Group activities into urban functions
-        gdf["naf2"] = gdf["activitePrincipaleEtablissement"].astype(str).str[:2]
-        gdf["fonction"] = gdf["naf2"].map(NAF2_TO_FONCTION).fillna("autre")
+        # Group activities into urban functions, as a categorical with the functions preset
+        # (int8 codes looked up on the NAF table, divisions outside the table fall into "autre")
+        codes = pd.Index(list(NAF2_TO_FONCTION)).get_indexer(gdf["naf2"])
+        codes[codes < 0] = len(NAF2_TO_FONCTION)
+        fonctions = pd.Categorical.from_codes(codes, categories=[*NAF2_TO_FONCTION.values(), "autre"])
+        fonction_codes = fonctions.codes
 
-        # Spatial join: assign establishments to grid cells
-        joined = gpd.sjoin(grid, gdf[["geometry", "fonction"]], how="left", predicate="contains")
+        # Spatial query on the grid index: assign establishments to grid cells
+        points = shapely.points(gdf["longitude"].to_numpy(dtype=float), gdf["latitude"].to_numpy(dtype=float))
+        pts_idx, cell_idx = query_grid(grid, points, predicate="within")
 
-        # Compute Shannon entropy for each grid cell
-        def entropy(group):
-            counts = group["fonction"].value_counts()
-            probs = counts / counts.sum()
-            return -(probs * np.log(probs)).sum()
+        # Compute Shannon entropy for each grid cell from the cell × function count matrix
+        # (cells without any establishment get an empty row, hence an entropy of 0)
+        M = np.zeros((len(grid), len(fonctions.categories)), dtype=np.int32)
+        np.add.at(M, (cell_idx, fonction_codes[pts_idx]), 1)
+        row_sum = M.sum(axis=1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            p = np.where(row_sum > 0, M / row_sum, 0)
+            logp = np.where(p > 0, np.log(p), 0)
+        H = -(p * logp).sum(axis=1)
 
-        entropies = joined.groupby("idINSPIRE", group_keys=False).apply(entropy).reset_index(name="indice_mixite_fonctionnelle")
+        entropies = pd.DataFrame({"idINSPIRE": grid["idINSPIRE"].to_numpy(), "indice_mixite_fonctionnelle": H})
 
         return entropies
 
@@ -100,12 +102,10 @@ def compute_indice_mixite_fonctionnelle(grid: gpd.GeoDataFrame) -> pd.DataFrame:
 if __name__ == "__main__":
     config = load_config()  # Load project configuration
     maillage = config["maillage"]
-    departement = config["departement"]
-    grid_path = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
-    grid = gpd.read_file(grid_path).to_crs("EPSG:2154")
+    grid = load_grid()
 
     print_status("Computing functional mix index", "info")
     result = compute_indice_mixite_fonctionnelle(grid)
-    output_path = f"appli/output/features/indice_mixite_fonctionnelle_{maillage}m.csv"
-    result.to_csv(output_path, index=False)
+    output_path = f"appli/output/features/indice_mixite_fonctionnelle_{maillage}m"
+    output_path = write_table(result, output_path)
     print_status("Functional mix index exported", "ok", output_path)
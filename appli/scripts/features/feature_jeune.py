@@ -7,13 +7,13 @@ Usage : Script for generating spatial features related to the population of youn
 """
 
 import pandas as pd
+import numpy as np
 import os
-from appli.scripts.features.features_utils import load_config, print_status
+from appli.scripts.features.features_utils import load_config, print_status, write_table
 
 def compute_part_jeunes() -> pd.DataFrame:
     try:
         config = load_config()  # Load project configuration
-        departement = config["departement"]
         maillage = int(config["maillage"])
         path = f"appli/data/features/recens_agrege_{maillage}m.csv"
 
@@ -31,17 +31,17 @@ def compute_part_jeunes() -> pd.DataFrame:
             print_status(f"Missing columns in census file: {missing}", "err")
             return pd.DataFrame(columns=["idINSPIRE", "part_jeunes"])
 
-        # Convert columns to numeric and handle NaN values
+        # Convert columns to numeric (float32) and handle NaN values
         for col in required[1:]:
-            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype("float32")
 
         # Calculate the population of young people and their proportion
         df["population_jeunes"] = (
             df["ind_0_3"] + df["ind_4_5"] + df["ind_6_10"] + df["ind_11_17"] + df["ind_18_24"]
         )
-        df["part_jeunes"] = df.apply(
-            lambda row: row["population_jeunes"] / row["ind"] if row["ind"] > 0 else 0, axis=1
-        )
+        # (0 for cells without any inhabitant)
+        ind = df["ind"].to_numpy()
+        df["part_jeunes"] = np.divide(df["population_jeunes"].to_numpy(), ind, out=np.zeros(len(ind)), where=ind > 0)
 
         return df[["idINSPIRE", "part_jeunes"]]
 
@@ -55,6 +55,6 @@ if __name__ == "__main__":
     maillage = config["maillage"]
     print_status("Computing proportion of young people", "info")
     result = compute_part_jeunes()
-    output_path = f"appli/output/features/part_jeunes_{maillage}m.csv"
-    result.to_csv(output_path, index=False)
+    output_path = f"appli/output/features/part_jeunes_{maillage}m"
+    output_path = write_table(result, output_path)
     print_status("Proportion of young people exported", "ok", output_path)
@@ -8,18 +8,14 @@ Usage : Feature generation step in the feature pipeline.
 """
 
 import os
+import numpy as np
 import pandas as pd
+import shapely
 import geopandas as gpd
-from appli.scripts.features.features_utils import print_status, load_config
-
-config = load_config()
-departement = config["departement"]
-maillage = config["maillage"]
+from appli.scripts.features.features_utils import print_status, load_config, query_grid, load_topo, weighted_sums, to_float32, load_grid, write_table
 
 # === SCRIPT PARAMETERS ===
 ROUTE_PATH = "appli/data/topo/TRONCON_DE_ROUTE.shp"
-GRID_PATH = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
-OUTPUT_PATH = f"appli/output/features/largeur_moyenne_voirie_{maillage}m.csv"
 
 
 # Main function
@@ -31,26 +27,25 @@ def compute_largeur_moyenne_voirie(grid: gpd.GeoDataFrame) -> pd.DataFrame:
             return pd.DataFrame(columns=["idINSPIRE", "largeur_moyenne_voirie"])
 
         # Load and clean data
-        voirie = gpd.read_file(ROUTE_PATH).to_crs("EPSG:2154")
+        voirie = load_topo("TRONCON_DE_ROUTE", columns=["LARGEUR"], bbox=tuple(grid.total_bounds))  # Only roads within the grid extent
         voirie = voirie[voirie["LARGEUR"].notna()]  # Filter rows with valid width data
-        voirie["largeur"] = pd.to_numeric(voirie["LARGEUR"], errors="coerce")
-        voirie["longueur"] = voirie.geometry.length  # Compute road segment lengths
+        # (float32 is enough for the sums, the final division is done in float64)
+        voirie["largeur"] = to_float32(voirie["LARGEUR"])
+        voirie["longueur"] = shapely.length(voirie.geometry.values).astype(np.float32)  # Compute road segment lengths
         voirie = voirie.dropna(subset=["largeur", "longueur"])  # Remove invalid rows
 
-        # Clean inherited columns
-        for df in [voirie, grid]:
-            df.drop(columns=["index_right"], inplace=True, errors="ignore")
-
-        # Spatial join: assign road segments to grid cells
-        joined = gpd.sjoin(voirie, grid, how="inner", predicate="intersects")
+        # Spatial query on the grid index: assign road segments to grid cells
+        voirie_idx, grid_idx = query_grid(grid, voirie.geometry.values, predicate="intersects")
+        largeur = voirie["largeur"].to_numpy().take(voirie_idx)
+        longueur = voirie["longueur"].to_numpy().take(voirie_idx)
 
-        # Weighted average width: sum(length * width) / sum(length)
-        joined["largeur_pondérée"] = joined["largeur"] * joined["longueur"]
-        grouped = joined.groupby("idINSPIRE").agg(
-            somme_largeur=("largeur_pondérée", "sum"),
-            somme_longueur=("longueur", "sum")
-        ).reset_index()
-        grouped["largeur_moyenne_voirie"] = grouped["somme_largeur"] / grouped["somme_longueur"]
+        # Weighted average width: sum(length * width) / sum(length), accumulated per grid cell position
+        num, den = weighted_sums(grid_idx, largeur, longueur, len(grid))
+        cells = np.unique(grid_idx)
+        grouped = pd.DataFrame({
+            "idINSPIRE": grid["idINSPIRE"].to_numpy().take(cells),
+            "largeur_moyenne_voirie": num[cells] / den[cells],
+        })
 
         return grouped[["idINSPIRE", "largeur_moyenne_voirie"]]
 
@@ -64,8 +59,9 @@ def compute_largeur_moyenne_voirie(grid: gpd.GeoDataFrame) -> pd.DataFrame:
 if __name__ == "__main__":
     print_status("Computing weighted average road width", "info")
 
-    grid = gpd.read_file(GRID_PATH).to_crs("EPSG:2154")
+    config = load_config()  # Load project configuration
+    grid = load_grid()
     result = compute_largeur_moyenne_voirie(grid)
 
-    result.to_csv(OUTPUT_PATH, index=False)
-    print_status("Weighted average road width exported", "ok", OUTPUT_PATH)
+    output_path = write_table(result, f"appli/output/features/largeur_moyenne_voirie_{config['maillage']}m")
+    print_status("Weighted average road width exported", "ok", output_path)
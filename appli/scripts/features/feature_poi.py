@@ -10,17 +10,17 @@ Usage : Script for generating spatial features related to POI density and import
 import geopandas as gpd
 import pandas as pd
 import os
-from appli.scripts.features.features_utils import load_config, print_status
+import pyarrow.parquet as pq
+from appli.scripts.features.features_utils import load_config, print_status, groupby_cell, load_grid, write_table
 
 def compute_score_poi_pondere(grid: gpd.GeoDataFrame) -> pd.DataFrame:
     try:
-        config = load_config()  # Load project configuration
         base_dir = "appli/data/osm"
         files = {
-            "amenity": os.path.join(base_dir, "amenity.geojson"),
-            "shop": os.path.join(base_dir, "shop.geojson"),
-            "office": os.path.join(base_dir, "office.geojson"),
-            "leisure": os.path.join(base_dir, "leisure.geojson"),
+            "amenity": os.path.join(base_dir, "amenity.parquet"),
+            "shop": os.path.join(base_dir, "shop.parquet"),
+            "office": os.path.join(base_dir, "office.parquet"),
+            "leisure": os.path.join(base_dir, "leisure.parquet"),
         }
 
         # Load the scoring catalog
@@ -29,18 +29,16 @@ def compute_score_poi_pondere(grid: gpd.GeoDataFrame) -> pd.DataFrame:
 
         all_poi = []
 
-        # Load POI files and assign weights
+        # Load POI files (only the tag and geometry columns)
         for tag, path in files.items():
             if not os.path.exists(path):
-                print_status(f"{tag}.geojson missing", "err")
+                print_status(f"{tag}.parquet missing", "err")
                 continue
-            gdf = gpd.read_file(path).to_crs("EPSG:2154")
-            if tag not in gdf.columns:
+            if tag not in pq.read_schema(path).names:
                 print_status(f"Field {tag} missing in {path}", "err")
                 continue
-            gdf["type_poi"] = gdf[tag]
-            gdf["poids"] = gdf["type_poi"].map(weights).fillna(0)  # Map weights to POI types
-            all_poi.append(gdf[["geometry", "poids"]])
+            gdf = gpd.read_parquet(path, columns=[tag, "geometry"]).to_crs("EPSG:2154")
+            all_poi.append(gdf.rename(columns={tag: "type_poi"}))
 
         # Check if any valid POI data was loaded
         if not all_poi:
@@ -51,12 +49,17 @@ def compute_score_poi_pondere(grid: gpd.GeoDataFrame) -> pd.DataFrame:
         poi_combined = pd.concat(all_poi, ignore_index=True)
         poi_combined = gpd.GeoDataFrame(poi_combined, geometry="geometry", crs="EPSG:2154")
 
+        # Assign weights to POI types (one lookup per distinct type through the categorical dtype)
+        poi_combined["poids"] = (
+            poi_combined["type_poi"].astype("category").map(weights).astype(float).fillna(0)
+        )
+        poi_combined = poi_combined[["geometry", "poids"]]
+
         # Spatial join with the grid
         joined = gpd.sjoin(grid, poi_combined, how="left", predicate="contains")
 
         # Aggregate scores by grid cell
-        scores = joined.groupby("idINSPIRE")["poids"].sum().reset_index()
-        scores.rename(columns={"poids": "score_poi_pondere"}, inplace=True)
+        scores = groupby_cell(joined, {"score_poi_pondere": ("poids", "sum")})
 
         return scores
 
@@ -68,12 +71,10 @@ def compute_score_poi_pondere(grid: gpd.GeoDataFrame) -> pd.DataFrame:
 if __name__ == "__main__":
     config = load_config()  # Load project configuration
     maillage = config["maillage"]
-    departement = config["departement"]
-    grid_path = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
-    grid = gpd.read_file(grid_path).to_crs("EPSG:2154")
+    grid = load_grid()
 
     print_status("Computing weighted POI score", "info")
     result = compute_score_poi_pondere(grid)
-    output_path = f"appli/output/features/score_poi_pondere_{maillage}m.csv"
-    result.to_csv(output_path, index=False)
+    output_path = f"appli/output/features/score_poi_pondere_{maillage}m"
+    output_path = write_table(result, output_path)
     print_status("Weighted POI score exported", "ok", output_path)
@@ -7,13 +7,13 @@ Usage : Script for generating spatial features related to active population dens
 """
 
 import pandas as pd
+import numpy as np
 import os
-from appli.scripts.features.features_utils import load_config, print_status
+from appli.scripts.features.features_utils import load_config, print_status, write_table
 
 def compute_part_population_active() -> pd.DataFrame:
     try:
         config = load_config()  # Load project configuration
-        departement = config["departement"]
         maillage = int(config["maillage"])
         path = f"appli/data/features/recens_agrege_{maillage}m.csv"
 
@@ -31,15 +31,15 @@ def compute_part_population_active() -> pd.DataFrame:
             print_status(f"Missing columns in census file: {missing}", "err")
             return pd.DataFrame(columns=["idINSPIRE", "part_population_active"])
 
-        # Convert columns to numeric and handle NaN values
+        # Convert columns to numeric (float32) and handle NaN values
         for col in required[1:]:
-            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype("float32")
 
         # Calculate active population
         df["population_active"] = df["ind_18_24"] + df["ind_25_39"] + df["ind_40_54"] + df["ind_55_64"]
-        df["part_population_active"] = df.apply(
-            lambda row: row["population_active"] / row["ind"] if row["ind"] > 0 else 0, axis=1
-        )
+        # (0 for cells without any inhabitant)
+        ind = df["ind"].to_numpy()
+        df["part_population_active"] = np.divide(df["population_active"].to_numpy(), ind, out=np.zeros(len(ind)), where=ind > 0)
 
         return df[["idINSPIRE", "part_population_active"]]
 
@@ -53,6 +53,6 @@ if __name__ == "__main__":
     maillage = config["maillage"]
     print_status("Computing proportion of active population", "info")
     result = compute_part_population_active()
-    output_path = f"appli/output/features/part_population_active_{maillage}m.csv"
-    result.to_csv(output_path, index=False)
+    output_path = f"appli/output/features/part_population_active_{maillage}m"
+    output_path = write_table(result, output_path)
     print_status("Proportion of active population exported", "ok", output_path)
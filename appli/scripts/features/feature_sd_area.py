@@ -8,14 +8,14 @@ Usage : Script for generating spatial features related to building surface varia
 
 import geopandas as gpd
 import pandas as pd
+import shapely
+import numpy as np
 import os
-from appli.scripts.features.features_utils import load_config, print_status
+from appli.scripts.features.features_utils import load_config, print_status, load_topo, query_grid, std_by_cell, load_grid, write_table
 
 def compute_ecart_type_surface_batiment(grid: gpd.GeoDataFrame) -> pd.DataFrame:
     # Compute the standard deviation of building surface areas within each grid cell.
     try:
-        config = load_config()  # Load project configuration
-        departement = config["departement"]
         path_bati = "appli/data/topo/BATIMENT.shp"
 
         # Check if the building file exists
@@ -24,17 +24,18 @@ def compute_ecart_type_surface_batiment(grid: gpd.GeoDataFrame) -> pd.DataFrame:
             return pd.DataFrame(columns=["idINSPIRE", "ecart_type_surface_batiment"])
 
         # Load buildings and grid
-        bati = gpd.read_file(path_bati).to_crs("EPSG:2154")
-        bati = bati[bati.geometry.type == "Polygon"]  # Keep only polygons (buildings)
-        bati["area"] = bati.geometry.area  # Compute surface area
-        bati = bati[bati["area"] > 0]  # Filter buildings with valid surface area
+        bati = load_topo("BATIMENT", columns=[], bbox=tuple(grid.total_bounds))  # Only buildings within the grid extent
+        area = shapely.area(bati.geometry.values).astype(np.float32)  # Compute surface area
+        # Keep polygons (buildings) with a positive surface area, in a single indexing pass
+        ok = (shapely.get_type_id(bati.geometry.values) == shapely.GeometryType.POLYGON) & (area > 0)
+        bati = bati[ok].assign(area=area[ok])
 
-        # Spatial join: assign buildings to grid cells
-        joined = gpd.sjoin(bati, grid, how="inner", predicate="intersects")
+        # Spatial query on the grid index: assign buildings to grid cells
+        bati_idx, cell_idx = query_grid(grid, bati.geometry.values, predicate="intersects")
 
         # Compute standard deviation of surface area
-        result = joined.groupby("idINSPIRE")["area"].std().reset_index()
-        result.rename(columns={"area": "ecart_type_surface_batiment"}, inplace=True)
+        cells, std = std_by_cell(cell_idx, bati["area"].to_numpy()[bati_idx], len(grid))
+        result = pd.DataFrame({"idINSPIRE": grid["idINSPIRE"].to_numpy()[cells], "ecart_type_surface_batiment": std})
 
         return result
 
@@ -46,12 +47,10 @@ def compute_ecart_type_surface_batiment(grid: gpd.GeoDataFrame) -> pd.DataFrame:
 if __name__ == "__main__":
     config = load_config()  # Load project configuration
     maillage = config["maillage"]
-    departement = config["departement"]
-    grid_path = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
-    grid = gpd.read_file(grid_path).to_crs("EPSG:2154")
+    grid = load_grid()
 
     print_status("Computing standard deviation of building surface areas", "info")
     result = compute_ecart_type_surface_batiment(grid)
-    output_path = f"appli/output/features/ecart_type_surface_batiment_{maillage}m.csv"
-    result.to_csv(output_path, index=False)
+    output_path = f"appli/output/features/ecart_type_surface_batiment_{maillage}m"
+    output_path = write_table(result, output_path)
     print_status("Standard deviation of building surface areas exported", "ok", output_path)
@@ -8,14 +8,14 @@ Usage : Script for generating spatial features related to building height variab
 
 import geopandas as gpd
 import pandas as pd
+import shapely
+import pyarrow.compute as pc
 import os
-from appli.scripts.features.features_utils import load_config, print_status
+from appli.scripts.features.features_utils import load_config, print_status, load_bati_clean, std_by_cell, load_grid, write_table
 
 def compute_ecart_type_hauteur(grid: gpd.GeoDataFrame) -> pd.DataFrame:
     # Compute the standard deviation of building heights within each grid cell.
     try:
-        config = load_config()  # Load project configuration
-        departement = config["departement"]
         path_bati = "appli/data/topo/BATIMENT.shp"
 
         # Check if the building file exists
@@ -23,19 +23,14 @@ def compute_ecart_type_hauteur(grid: gpd.GeoDataFrame) -> pd.DataFrame:
             print_status("BATIMENT.shp file not found", "err", path_bati)
             return pd.DataFrame(columns=["idINSPIRE", "ecart_type_hauteur"])
 
-        # Load buildings and grid
-        bati = gpd.read_file(path_bati).to_crs("EPSG:2154")
-        bati = bati[bati.geometry.type == "Polygon"]  # Keep only polygons (buildings)
-        bati = bati[bati["HAUTEUR"].notna()]  # Filter buildings with valid height data
-        bati["hauteur"] = pd.to_numeric(bati["HAUTEUR"], errors="coerce")
-        bati = bati.dropna(subset=["hauteur"])  # Remove rows with invalid height values
+        # Load the repaired buildings with a valid numeric height and their grid cell (cached, buildings
+        # without height are dropped by the Parquet reader before decoding their geometry), and keep polygons
+        bati = load_bati_clean(columns=["hauteur", "cell"], filters=pc.field("hauteur").is_valid())
+        bati = bati[shapely.get_type_id(bati.geometry.values) == shapely.GeometryType.POLYGON]
 
-        # Spatial join with the grid
-        joined = gpd.sjoin(bati, grid, how="inner", predicate="intersects")
-
-        # Compute standard deviation of building heights
-        result = joined.groupby("idINSPIRE")["hauteur"].std().reset_index()
-        result.rename(columns={"hauteur": "ecart_type_hauteur"}, inplace=True)
+        # Compute standard deviation of building heights per grid cell position
+        cells, std = std_by_cell(bati["cell"].to_numpy(), bati["hauteur"].to_numpy(), len(grid))
+        result = pd.DataFrame({"idINSPIRE": grid["idINSPIRE"].to_numpy()[cells], "ecart_type_hauteur": std})
 
         return result
 
@@ -47,12 +42,10 @@ def compute_ecart_type_hauteur(grid: gpd.GeoDataFrame) -> pd.DataFrame:
 if __name__ == "__main__":
     config = load_config()  # Load project configuration
     maillage = config["maillage"]
-    departement = config["departement"]
-    grid_path = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
-    grid = gpd.read_file(grid_path).to_crs("EPSG:2154")
+    grid = load_grid()
 
     print_status("Computing standard deviation of building heights", "info")
     result = compute_ecart_type_hauteur(grid)
-    output_path = f"appli/output/features/ecart_type_hauteur_{maillage}m.csv"
-    result.to_csv(output_path, index=False)
+    output_path = f"appli/output/features/ecart_type_hauteur_{maillage}m"
+    output_path = write_table(result, output_path)
     print_status("Standard deviation of building heights exported", "ok", output_path)
@@ -9,17 +9,15 @@ Usage : Script for generating spatial features related to building compactness.
 
 import geopandas as gpd
 import pandas as pd
+import shapely
 import numpy as np
 import os
 from shapely.geometry import Polygon
-from appli.scripts.features.features_utils import load_config, print_status
+from appli.scripts.features.features_utils import load_config, print_status, load_bati_clean, grouped_mean_std, load_grid, write_table
 
 def compute_shape_index_moyen(grid: gpd.GeoDataFrame) -> pd.DataFrame:
     # Compute the average shape index of buildings within each grid cell.
     try:
-        config = load_config()  # Load project configuration
-        departement = config["departement"]
-        maillage = int(config["maillage"])
         path_bati = "appli/data/topo/BATIMENT.shp"
 
         # Check if the building file exists
@@ -27,24 +25,23 @@ def compute_shape_index_moyen(grid: gpd.GeoDataFrame) -> pd.DataFrame:
             print_status("BATIMENT.shp file not found", "err", path_bati)
             return pd.DataFrame(columns=["idINSPIRE", "shape_index_moyen"])
 
-        # Load buildings and grid
-        bati = gpd.read_file(path_bati).to_crs("EPSG:2154")
-        bati = bati[bati.geometry.type == "Polygon"]  # Ensure the geometries are polygons
+        # Load the repaired buildings with their area, perimeter and grid cell (cached), and keep
+        # polygons with a valid surface area, working on NumPy arrays
+        bati = load_bati_clean(columns=["area", "perimeter", "cell"])
+        geoms = bati.geometry.values
+        area = bati["area"].to_numpy()
+        keep = (shapely.get_type_id(geoms) == shapely.GeometryType.POLYGON) & (area > 0)
+        area, cell_idx = area[keep], bati["cell"].to_numpy()[keep]
 
-        # Compute surface area and perimeter
-        bati["area"] = bati.geometry.area
-        bati["perimeter"] = bati.geometry.length
+        # Compute the shape index perimeter² / (4π · area) in place on NumPy arrays
+        shape_index = bati["perimeter"].to_numpy()[keep]
+        np.multiply(shape_index, shape_index, out=shape_index)
+        shape_index /= (4.0 * np.pi) * area
 
-        # Compute the shape index
-        bati = bati[bati["area"] > 0]  # Filter buildings with valid surface area
-        bati["shape_index"] = (bati["perimeter"] ** 2) / (4 * np.pi * bati["area"])
-
-        # Spatial join with the grid
-        joined = gpd.sjoin(bati, grid, how="inner", predicate="intersects")
-
-        # Compute the average shape index per grid cell
-        shape_df = joined.groupby("idINSPIRE")["shape_index"].mean().reset_index()
-        shape_df.rename(columns={"shape_index": "shape_index_moyen"}, inplace=True)
+        # Compute the average shape index per grid cell position
+        count, mean, _ = grouped_mean_std(cell_idx, shape_index, len(grid))
+        cells = np.flatnonzero(count)
+        shape_df = pd.DataFrame({"idINSPIRE": grid["idINSPIRE"].to_numpy().take(cells), "shape_index_moyen": mean[cells]})
 
         return shape_df
 
@@ -56,12 +53,10 @@ def compute_shape_index_moyen(grid: gpd.GeoDataFrame) -> pd.DataFrame:
 if __name__ == "__main__":
     config = load_config()  # Load project configuration
     maillage = config["maillage"]
-    departement = config["departement"]
-    grid_path = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
-    grid = gpd.read_file(grid_path).to_crs("EPSG:2154")
+    grid = load_grid()
 
     print_status("Computing average shape index", "info")
     result = compute_shape_index_moyen(grid)
-    output_path = f"appli/output/features/shape_index_moyen_{maillage}m.csv"
-    result.to_csv(output_path, index=False)
+    output_path = f"appli/output/features/shape_index_moyen_{maillage}m"
+    output_path = write_table(result, output_path)
     print_status("Average shape index exported", "ok", output_path)
@@ -10,17 +10,14 @@ Usage : Feature generation step in the feature pipeline.
 
 import geopandas as gpd
 import pandas as pd
+import numpy as np
+import shapely
+import pyarrow.compute as pc
 import os
-from appli.scripts.features.features_utils import print_status, load_config
-
-config = load_config()
-departement = config["departement"]
-maillage = config["maillage"]
+from appli.scripts.features.features_utils import print_status, load_config, load_bati_clean, weighted_sums, load_grid, write_table
 
 # === PATHS ===
 BATI_PATH = "appli/data/topo/BATIMENT.shp"
-GRID_PATH = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
-OUTPUT_PATH = f"appli/output/features/volume_moyen_bati_{maillage}m.csv"
 
 
 # Main function
@@ -31,31 +28,19 @@ def compute_volume_moyen_par_maille(grid: gpd.GeoDataFrame) -> pd.DataFrame:
             print_status("BATIMENT.shp file not found", "err", BATI_PATH)
             return pd.DataFrame(columns=["idINSPIRE", "volume_moyen_bati"])
 
-        # Load and clean data
-        bati = gpd.read_file(BATI_PATH).to_crs("EPSG:2154")
-        bati = bati[bati.geometry.type.isin(["Polygon", "MultiPolygon"])]  # Keep polygons and multipolygons
-        bati["geometry"] = bati["geometry"].buffer(0)  # Fix invalid geometries
-        bati = bati[bati["HAUTEUR"].notna()]  # Filter buildings with valid height data
-        bati["hauteur"] = pd.to_numeric(bati["HAUTEUR"], errors="coerce")
-        bati["surface"] = bati.geometry.area  # Compute surface area
-        bati["volume"] = bati["surface"] * bati["hauteur"]  # Compute volume
-        bati = bati.dropna(subset=["volume", "surface"])  # Remove invalid rows
-        bati = bati[bati["surface"] > 0]  # Filter buildings with positive surface area
-
-        # Clean unnecessary columns
-        bati.drop(columns=["index_right"], inplace=True, errors="ignore")
-        grid.drop(columns=["index_right"], inplace=True, errors="ignore")
-
-        # Spatial join: assign buildings to grid cells
-        joined = gpd.sjoin(bati, grid, how="inner", predicate="intersects")
+        # Load the repaired buildings (cached repair, float32 surface area and height, grid cell) and
+        # compute volumes (buildings without height are dropped by the Parquet reader, before decoding their geometry)
+        bati = load_bati_clean(columns=["area", "hauteur", "cell"], filters=pc.field("hauteur").is_valid() & (pc.field("area") > 0))
+        bati["volume"] = bati["area"] * bati["hauteur"]  # Compute volume
 
-        # Weighted aggregation: sum(volume * surface) / sum(surface)
-        joined["prod"] = joined["volume"] * joined["surface"]
-        grouped = joined.groupby("idINSPIRE").agg(
-            somme_volume=("prod", "sum"),
-            somme_surface=("surface", "sum")
-        ).reset_index()
-        grouped["volume_moyen_bati"] = grouped["somme_volume"] / grouped["somme_surface"]
+        # Weighted aggregation: sum(volume * surface) / sum(surface), accumulated per grid cell position
+        cell_idx = bati["cell"].to_numpy()
+        num, den = weighted_sums(cell_idx, bati["volume"].to_numpy(), bati["area"].to_numpy(), len(grid))
+        cells = np.unique(cell_idx)
+        grouped = pd.DataFrame({
+            "idINSPIRE": grid["idINSPIRE"].to_numpy().take(cells),
+            "volume_moyen_bati": num[cells] / den[cells],
+        })
 
         return grouped[["idINSPIRE", "volume_moyen_bati"]]
 
@@ -69,8 +54,9 @@ def compute_volume_moyen_par_maille(grid: gpd.GeoDataFrame) -> pd.DataFrame:
 if __name__ == "__main__":
     print_status("Computing average built volume", "info")
 
-    grid = gpd.read_file(GRID_PATH).to_crs("EPSG:2154")
+    config = load_config()  # Load project configuration
+    grid = load_grid()
     result = compute_volume_moyen_par_maille(grid)
-    result.to_csv(OUTPUT_PATH, index=False)
+    output_path = write_table(result, f"appli/output/features/volume_moyen_bati_{config['maillage']}m")
 
-    print_status("Average built volume exported", "ok", OUTPUT_PATH)
+    print_status("Average built volume exported", "ok", output_path)
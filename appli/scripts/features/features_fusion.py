@@ -1,40 +1,45 @@
 """
 Script : features_fusion.py
-Objective : Merge all feature files for a given grid size into a single CSV file.
+Objective : Merge all feature files for a given grid size into a single file (Parquet or CSV).
 Author : LEDERMANN Quentin
 Date : June 2025
 Usage : Script for combining spatial features into a unified dataset.
 """
 
-import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import pandas as pd
-from appli.scripts.features.features_utils import load_config, print_status
+from appli.scripts.features.features_utils import load_config, print_status, read_table, write_table, latest_table
 
 def fusion_features():
     config = load_config()  # Load project configuration
     maillage = config["maillage"]
-    feature_dir = "appli/output/features"
+    feature_dir = Path("appli/output/features")
 
     print("=== MERGING FEATURES ===")
-    # Detect all feature files matching the grid size
-    all_files = [f for f in os.listdir(feature_dir) if f.endswith(f"_{maillage}m.csv")]
+    # Detect all feature files matching the grid size (CSV or Parquet, depending on the
+    # output_format used when they were written), keeping only the newest copy of each feature
+    files = [p for ext in ("csv", "parquet") for p in feature_dir.glob(f"*_{maillage}m.{ext}")]
+    stems = sorted({p.with_suffix("") for p in files})
+    all_files = [latest_table(str(stem)) for stem in stems]
     print_status("Files detected", "info", f"{len(all_files)} files found")
 
-    merged = None
-    for file in all_files:
-        path = os.path.join(feature_dir, file)
-        df = pd.read_csv(path)
+    # Read the feature tables concurrently (I/O and parsing release the GIL) and index each one
+    # on idINSPIRE, to align them all in a single outer concat instead of successive merges
+    def read_indexed(path):
+        df = read_table(str(path))
+        return df.set_index(df["idINSPIRE"].astype(str)).drop(columns="idINSPIRE")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        tables = list(executor.map(read_indexed, all_files))
 
-        # Merge files on the idINSPIRE column
-        if merged is None:
-            merged = df
-        else:
-            merged = pd.merge(merged, df, on="idINSPIRE", how="outer")
+    merged = None
+    if tables:
+        merged = pd.concat(tables, axis=1, join="outer").sort_index().rename_axis("idINSPIRE").reset_index()
 
     if merged is not None:
         # Export the merged file
-        output = f"appli/output/fusion/features_fusionnees_{maillage}m.csv"
-        merged.to_csv(output, index=False)
+        output = write_table(merged, f"appli/output/fusion/features_fusionnees_{maillage}m")
         print_status("Merged file exported", "ok", output)
         print("=== MERGING COMPLETED ===")
     else:
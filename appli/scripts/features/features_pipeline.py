@@ -6,13 +6,16 @@ Date : June 2025
 Usage : Master script for feature generation in the modeling pipeline.
 """
 
-import geopandas as gpd
-from appli.scripts.features.features_utils import load_config, print_status
+import os
+from concurrent.futures import ProcessPoolExecutor
+from appli.scripts.features.features_utils import load_config, print_status, write_table, topo_cache, bati_clean_cache, load_grid
 
 from appli.scripts.features.feature_poi import compute_score_poi_pondere
 from appli.scripts.features.feature_emp_est import compute_emplois_estimes_pondere
 from appli.scripts.features.feature_dens_eta import compute_densite_etablissements
 from appli.scripts.features.feature_dens_com import compute_densite_commerces
+from appli.scripts.features.feature_dens_voirie import compute_densite_voirie_optimisee
+from appli.scripts.features.feature_larg_moy_voirie import compute_largeur_moyenne_voirie
 from appli.scripts.features.feature_in_mix_fonc import compute_indice_mixite_fonctionnelle
 from appli.scripts.features.feature_pop_act import compute_part_population_active
 from appli.scripts.features.feature_jeune import compute_part_jeunes
@@ -21,40 +24,59 @@ from appli.scripts.features.feature_h_pond import compute_hauteur_ponderee_surfa
 from appli.scripts.features.feature_sd_h import compute_ecart_type_hauteur
 from appli.scripts.features.feature_sd_area import compute_ecart_type_surface_batiment
 from appli.scripts.features.feature_d_moy_bati import compute_distance_moyenne_batiments
+from appli.scripts.features.feature_vol_moy import compute_volume_moyen_par_maille
 
-def safe_run(name, func, grid):
+# (output name, feature function, whether the function takes the grid as argument).
+# Functions without the grid load their own inputs; those returning None export their own file.
+FEATURES = [
+    ("score_poi_pondere", compute_score_poi_pondere, True),
+    ("emplois_estimes_pondere", compute_emplois_estimes_pondere, True),
+    ("densite_etablissements", compute_densite_etablissements, False),
+    ("densite_commerces", compute_densite_commerces, False),
+    ("densite_voirie", compute_densite_voirie_optimisee, False),
+    ("largeur_moyenne_voirie", compute_largeur_moyenne_voirie, True),
+    ("indice_mixite_fonctionnelle", compute_indice_mixite_fonctionnelle, True),
+    ("part_population_active", compute_part_population_active, False),
+    ("part_jeunes", compute_part_jeunes, False),
+    ("shape_index_moyen", compute_shape_index_moyen, True),
+    ("hauteur_ponderee_surface", compute_hauteur_ponderee_surface, True),
+    ("ecart_type_hauteur", compute_ecart_type_hauteur, True),
+    ("ecart_type_surface_batiment", compute_ecart_type_surface_batiment, True),
+    ("distance_moyenne_batiments", compute_distance_moyenne_batiments, True),
+    ("volume_moyen_bati", compute_volume_moyen_par_maille, True),
+]
+
+def safe_run(name, func, needs_grid):
+    # Run in a worker process: each worker loads its own grid (nothing heavy is pickled between processes)
     try:
+        config = load_config()  # Load project configuration
         print_status(f"Starting {name}", "info")
-        df = func(grid) if grid is not None else func()
-        df.to_csv(f"appli/output/features/{name}_{config['maillage']}m.csv", index=False)
+        if needs_grid:
+            df = func(load_grid())
+        else:
+            df = func()
+        if df is not None:
+            write_table(df, f"appli/output/features/{name}_{config['maillage']}m")
         print_status(f"{name} completed", "ok")
     except Exception as e:
         print_status(f"{name} failed", "err", str(e))
 
 def main():
-    global config
-    config = load_config()  # Load project configuration
-    departement = config["departement"]
-    maillage = config["maillage"]
-
-    # Load the spatial grid
-    grid = gpd.read_file(f"appli/output/grid/grid_{departement}_{maillage}m.geojson").to_crs("EPSG:2154")
-
     print("=== STARTING FEATURE PIPELINE ===")
 
-    # Execute feature generation functions
-    safe_run("score_poi_pondere", compute_score_poi_pondere, grid)
-    safe_run("emplois_estimes_pondere", compute_emplois_estimes_pondere, grid)
-    safe_run("densite_etablissements", compute_densite_etablissements, grid)
-    safe_run("densite_commerces", compute_densite_commerces, grid)
-    safe_run("indice_mixite_fonctionnelle", compute_indice_mixite_fonctionnelle, grid)
-    safe_run("part_population_active", compute_part_population_active, None)
-    safe_run("part_jeunes", compute_part_jeunes, None)
-    safe_run("shape_index_moyen", compute_shape_index_moyen, grid)
-    safe_run("hauteur_ponderee_surface", compute_hauteur_ponderee_surface, grid)
-    safe_run("ecart_type_hauteur", compute_ecart_type_hauteur, grid)
-    safe_run("ecart_type_surface_batiment", compute_ecart_type_surface_batiment, grid)
-    safe_run("distance_moyenne_batiments", compute_distance_moyenne_batiments, grid)
+    # Build the reprojected BD TOPO caches once, before the workers read them
+    # (the repaired buildings cache builds the BATIMENT one)
+    for layer, build in (("BATIMENT", bati_clean_cache), ("TRONCON_DE_ROUTE", lambda: topo_cache("TRONCON_DE_ROUTE"))):
+        try:
+            build()
+        except Exception as e:
+            print_status(f"{layer} cache failed", "err", str(e))
+
+    # Execute feature generation functions in parallel, one process per feature
+    with ProcessPoolExecutor(max_workers=min(len(FEATURES), os.cpu_count() or 1)) as executor:
+        futures = [executor.submit(safe_run, name, func, needs_grid) for name, func, needs_grid in FEATURES]
+        for future in futures:
+            future.result()
 
     print("=== FEATURE PIPELINE COMPLETED ===")
 
@@ -1,5 +1,16 @@
+import functools
+import json
+import os
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import shapely
 import yaml
+from numba import njit, prange
 
+# Parsed once per process: every script of the pipeline reads the same settings file
+@functools.lru_cache(maxsize=None)
 def load_config(path="appli/config/settings.yaml"):
     with open(path, "r") as f:
         return yaml.safe_load(f)
@@ -11,3 +22,238 @@ def print_status(step: str, status: str = "ok", detail: str = ""):
     if detail:
         message += f" : {detail}"
     print(message)
+
+# Spatial index of each grid seen in this process, keyed by id() (the grid object is kept in the
+# entry so the id cannot be reused by another object)
+_GRID_TREES = {}
+
+def grid_tree(grid):
+    # Shapely STRtree on the grid cells, built once per grid and shared by every feature of the process
+    entry = _GRID_TREES.get(id(grid))
+    if entry is None or entry[0] is not grid:
+        entry = _GRID_TREES[id(grid)] = (grid, shapely.STRtree(grid.geometry.values))
+    return entry[1]
+
+def grid_file():
+    # Grid file of the configured department and cell size: the GeoParquet copy written by
+    # preprocess_create_grid, or the GeoJSON as fallback
+    config = load_config()
+    path = f"appli/output/grid/grid_{config['departement']}_{config['maillage']}m"
+    return f"{path}.parquet" if os.path.exists(f"{path}.parquet") else f"{path}.geojson"
+
+@functools.lru_cache(maxsize=1)
+def get_grid_and_tree():
+    # Grid of the configured department and cell size in EPSG:2154, with its spatial index.
+    # Read once per process: the returned grid is shared between features and must not be modified.
+    path = grid_file()
+    if path.endswith(".parquet"):
+        grid = gpd.read_parquet(path)
+    else:
+        grid = gpd.read_file(path, engine="pyogrio", use_arrow=True)
+    if grid.crs != "EPSG:2154":
+        grid = grid.to_crs("EPSG:2154")
+    return grid, grid_tree(grid)
+
+def load_grid():
+    return get_grid_and_tree()[0]
+
+def query_grid(grid, geoms, predicate="intersects"):
+    # Match geometries to grid cells through the shared STRtree of the grid.
+    # Returns two aligned arrays of positions: (geometry index, grid cell index).
+    return grid_tree(grid).query(geoms, predicate=predicate)
+
+def grid_cells_of_points(grid, x, y):
+    # Position in the grid of the cell holding each point (x, y), -1 outside the grid, computed by
+    # integer arithmetic instead of a spatial join: the grid is a regular raster of square cells
+    # (preprocess_create_grid), so each cell is identified by its (column, row) from the grid origin.
+    bounds = shapely.bounds(grid.geometry.values)
+    size = bounds[0, 2] - bounds[0, 0]
+    x0, y0 = bounds[:, 0].min(), bounds[:, 1].min()
+    col = np.rint((bounds[:, 0] - x0) / size).astype(np.int64)
+    row = np.rint((bounds[:, 1] - y0) / size).astype(np.int64)
+    n_rows = row.max() + 1
+    lookup = np.full((col.max() + 1) * n_rows, -1, dtype=np.int64)
+    lookup[col * n_rows + row] = np.arange(len(grid))
+    ix = np.floor((np.asarray(x) - x0) / size).astype(np.int64)
+    iy = np.floor((np.asarray(y) - y0) / size).astype(np.int64)
+    inside = (ix >= 0) & (ix <= col.max()) & (iy >= 0) & (iy < n_rows)
+    cells = np.full(len(ix), -1, dtype=np.int64)
+    cells[inside] = lookup[ix[inside] * n_rows + iy[inside]]
+    return cells
+
+def to_float32(values):
+    # Numeric column (BD TOPO HAUTEUR, LARGEUR...) as a float32 array: direct cast when the values
+    # are numbers or numeric strings, value-by-value parsing (invalid values → NaN) only otherwise
+    try:
+        return values.to_numpy(dtype=np.float32)
+    except (ValueError, TypeError):
+        return pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float32)
+
+def has_bbox_covering(path):
+    # Whether a GeoParquet file has the bbox covering column needed to read it with a bbox filter
+    geo = json.loads(pq.read_schema(path).metadata[b"geo"])
+    return "covering" in geo["columns"][geo["primary_column"]]
+
+def topo_cache(name):
+    # Path of the BD TOPO layer (e.g. "BATIMENT", "TRONCON_DE_ROUTE") reprojected to EPSG:2154 and
+    # cached once as GeoParquet, with a bbox covering column so that readers can skip row groups
+    # outside an extent; the cache is (re)built when missing, older than the shapefile or written
+    # without the bbox covering.
+    src = os.path.join("appli/data/topo", f"{name}.shp")
+    cache = os.path.join("appli/cache", f"{name}_2154.parquet")
+    if not os.path.exists(cache) or os.path.getmtime(cache) < os.path.getmtime(src) or not has_bbox_covering(cache):
+        gdf = gpd.read_file(src, engine="pyogrio", use_arrow=True).to_crs("EPSG:2154")
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        tmp = f"{cache}.{os.getpid()}.tmp"  # Atomic replace: feature scripts may run concurrently
+        gdf.to_parquet(tmp, geometry_encoding="WKB", write_covering_bbox=True)
+        os.replace(tmp, cache)
+    return cache
+
+def load_topo(name, columns=None, bbox=None, filters=None):
+    # Load a BD TOPO layer reprojected to EPSG:2154 from its GeoParquet cache, so each feature
+    # script only reads the requested columns instead of parsing and reprojecting the shapefile again.
+    # bbox (minx, miny, maxx, maxy) keeps only the features whose bounding box intersects it, and
+    # filters (a pyarrow expression) drops rows in the Parquet reader, before geometries are decoded.
+    return gpd.read_parquet(
+        topo_cache(name), columns=None if columns is None else [*columns, "geometry"], bbox=bbox, filters=filters
+    )
+
+def bati_clean_cache():
+    # Path of the buildings (polygons and multipolygons) of the BATIMENT cache with their invalid
+    # geometries repaired and their area, perimeter, numeric height (NaN when missing) and grid cell
+    # precomputed. The cell ("cell", position in the grid of the cell holding a point inside the
+    # building) is shared by all the building features; buildings outside the grid are dropped.
+    # Cached once per grid as GeoParquet, rebuilt with the BATIMENT cache or the grid.
+    config = load_config()
+    src = topo_cache("BATIMENT")
+    cache = os.path.join("appli/cache", f"BATIMENT_clean_{config['departement']}_{config['maillage']}m.parquet")
+    if not os.path.exists(cache) or os.path.getmtime(cache) < max(os.path.getmtime(src), os.path.getmtime(grid_file())):
+        grid = load_grid()
+        bati = gpd.read_parquet(src, columns=["HAUTEUR", "geometry"], bbox=tuple(grid.total_bounds))
+        types = shapely.get_type_id(bati.geometry.values)
+        bati = bati[(types == shapely.GeometryType.POLYGON) | (types == shapely.GeometryType.MULTIPOLYGON)]
+        # Repair only the invalid geometries, keeping polygonal results (collapsed parts are dropped)
+        geoms = bati.geometry.values.copy()
+        invalid = ~shapely.is_valid(geoms)
+        geoms[invalid] = shapely.make_valid(geoms[invalid], method="structure", keep_collapsed=False)
+        # Grid cell holding a point inside each building (buildings are small compared to the cells,
+        # and straddling ones are counted once), -1 outside the grid
+        bati_idx, cell_idx = query_grid(grid, shapely.point_on_surface(geoms), predicate="within")
+        cell = np.full(len(geoms), -1, dtype=np.int32)
+        cell[bati_idx] = cell_idx
+        keep = cell >= 0
+        geoms = geoms[keep]
+        # float32 columns: enough precision for the per-cell sums, which accumulate in float64
+        clean = gpd.GeoDataFrame({
+            "area": shapely.area(geoms).astype(np.float32),
+            "perimeter": shapely.length(geoms).astype(np.float32),
+            "hauteur": to_float32(bati["HAUTEUR"])[keep],
+            "cell": cell[keep],
+        }, geometry=geoms, crs=bati.crs)
+        tmp = f"{cache}.{os.getpid()}.tmp"  # Atomic replace: feature scripts may run concurrently
+        clean.to_parquet(tmp, compression="brotli", geometry_encoding="WKB", write_covering_bbox=True)
+        os.replace(tmp, cache)
+    return cache
+
+def load_bati_clean(columns=None, filters=None):
+    # Load the repaired buildings with the requested precomputed columns ("area", "perimeter", "hauteur", "cell"),
+    # filters (a pyarrow expression) dropping rows before their geometries are decoded
+    return gpd.read_parquet(
+        bati_clean_cache(), columns=None if columns is None else [*columns, "geometry"], filters=filters
+    )
+
+def groupby_cell(joined, aggregations):
+    # Aggregate a (feature, grid cell) join per grid cell, grouping on int32 codes of idINSPIRE
+    # instead of hashing the identifier strings. aggregations maps each output column to a
+    # (input column, function) pair, as in pandas named aggregation.
+    codes, labels = pd.factorize(joined["idINSPIRE"])
+    grouped = joined.groupby(codes.astype(np.int32)).agg(**aggregations)
+    grouped.insert(0, "idINSPIRE", labels.take(grouped.index.to_numpy()))
+    return grouped.reset_index(drop=True)
+
+def std_by_cell(cell_idx, values, n_cells):
+    # Sample standard deviation (ddof=1, as pandas) of values per grid cell position, from the
+    # grouped_mean_std kernel. Returns (cells with at least one value, std), std being NaN for
+    # cells holding a single value.
+    count, _, std = grouped_mean_std(cell_idx, np.asarray(values, dtype=np.float64), n_cells)
+    cells = np.flatnonzero(count)
+    return cells, std[cells]
+
+def write_table(df, path):
+    # Write a feature table as zstd-compressed Parquet (default) or CSV, depending on the
+    # output_format key of settings.yaml. path is given without extension; returns the written path.
+    # The copy in the other format, left by an earlier run, is removed so readers never see both.
+    if load_config().get("output_format", "parquet") == "parquet":
+        out, stale = f"{path}.parquet", f"{path}.csv"
+        df.to_parquet(out, index=False, compression="zstd")
+    else:
+        out, stale = f"{path}.csv", f"{path}.parquet"
+        df.to_csv(out, index=False)
+    if os.path.exists(stale):
+        os.remove(stale)
+    return out
+
+def latest_table(path):
+    # Path of the most recently written copy (Parquet or CSV) of the table path, given without
+    # extension, or None if neither exists
+    candidates = [p for p in (f"{path}.parquet", f"{path}.csv") if os.path.exists(p)]
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+def read_table(path):
+    # Read a feature table written by write_table, whichever format it was written in
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, engine="pyarrow")
+
+# The numba kernels below are compiled with cache=True: their machine code is stored on disk
+# (__pycache__) and reused by every pipeline worker process and later runs instead of being re-JITed.
+
+# Per-cell weighted sums in a single pass over (cell, value, weight) triples:
+# num[c] = sum(value * weight), den[c] = sum(weight). Serial loop, since several
+# triples update the same cell.
+@njit(cache=True)
+def weighted_sums(cell_idx, values, weights, n_cells):
+    num = np.zeros(n_cells)
+    den = np.zeros(n_cells)
+    for i in range(len(cell_idx)):
+        c = cell_idx[i]
+        num[c] += values[i] * weights[i]
+        den[c] += weights[i]
+    return num, den
+
+# Per-cell count, mean and sample standard deviation (ddof=1, as pandas) in a single pass of
+# Welford updates over (cell, value) pairs, which keeps constant groups at exactly 0. mean is NaN
+# for empty cells and std for cells holding fewer than two values. Serial loop, since several
+# pairs update the same cell.
+@njit(cache=True)
+def grouped_mean_std(cell_idx, values, n_cells):
+    count = np.zeros(n_cells, dtype=np.int64)
+    mean = np.zeros(n_cells)
+    m2 = np.zeros(n_cells)
+    for i in range(len(cell_idx)):
+        c = cell_idx[i]
+        count[c] += 1
+        delta = values[i] - mean[c]
+        mean[c] += delta / count[c]
+        m2[c] += delta * (values[i] - mean[c])
+    std = np.full(n_cells, np.nan)
+    for c in range(n_cells):
+        n = count[c]
+        if n == 0:
+            mean[c] = np.nan
+        elif n > 1:
+            std[c] = np.sqrt(m2[c] / (n - 1))
+    return count, mean, std
+
+# Per-cell sums of several value columns over (cell, row of values) pairs: out[c, j] = sum of
+# values[i, j] over the pairs of cell c, NaN values being skipped (as pandas sum). Columns are
+# summed in parallel; within a column the loop is serial, since several pairs update the same cell.
+@njit(parallel=True, cache=True)
+def groupsum2d(cell_idx, values, n_cells):
+    out = np.zeros((n_cells, values.shape[1]))
+    for j in prange(values.shape[1]):
+        for i in range(len(cell_idx)):
+            v = values[i, j]
+            if not np.isnan(v):
+                out[cell_idx[i], j] += v
+    return out
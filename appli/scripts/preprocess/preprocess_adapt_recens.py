@@ -1,15 +1,17 @@
 """
 Script : preprocess_adapt_recens.py
 Objective : Adapt census data (200m grid) to a user-defined grid size.
-            Aggregate INSEE indicators per grid cell using spatial joins.
+            Aggregate INSEE indicators per grid cell from the census cell centroids.
 Author : LEDERMANN Quentin
 Date : June 2025
 Usage : Preprocessing step for adapting census data to custom grids.
 """
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-from appli.scripts.features.features_utils import load_config, print_status
+import shapely
+from appli.scripts.features.features_utils import load_config, print_status, load_grid, grid_cells_of_points, groupsum2d
 
 def adapt_recens_to_maillage():
     # Adapt census data to the user-defined grid size and aggregate indicators.
@@ -20,33 +22,33 @@ def adapt_recens_to_maillage():
     maillage = int(config["maillage"])
 
     # Define input/output file paths
-    path_recens = f"appli/data/recens/recens_{departement}.geojson"
-    path_grid = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
+    path_recens = f"appli/data/recens/recens_{departement}.parquet"
     path_out = f"appli/data/features/recens_agrege_{maillage}m.csv"
 
     # Load INSEE data (200m grid cells)
     print_status("Loading census data", "info")
-    recens = gpd.read_file(path_recens).to_crs("EPSG:2154")
+    recens = gpd.read_parquet(path_recens).to_crs("EPSG:2154")
 
     # Force conversion of all indicator columns to float
     cols_to_convert = [col for col in recens.columns if col.startswith(("ind", "log", "men"))]
-    recens[cols_to_convert] = recens[cols_to_convert].apply(pd.to_numeric, errors="coerce")
+    values = recens[cols_to_convert].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
 
-    # Load the target grid
+    # Load the target grid (shared GeoParquet copy, with its spatial index)
     print_status(f"Loading target grid {maillage}m", "info")
-    grid = gpd.read_file(path_grid).to_crs("EPSG:2154")
+    grid = load_grid()
 
-    # Perform spatial join with predicate='intersects' to capture exact overlaps
-    print_status("Performing spatial join between grid and census cells", "info")
-    joint = gpd.sjoin(grid, recens, how="left", predicate="intersects")
+    # Assign each census cell to the grid cell holding its centroid, by integer indexing on the
+    # regular grid (no spatial join), so that each census cell is counted in a single grid cell
+    print_status("Assigning census cells to grid cells", "info")
+    centroids = shapely.centroid(recens.geometry.values)
+    cell_idx = grid_cells_of_points(grid, shapely.get_x(centroids), shapely.get_y(centroids))
+    inside = cell_idx >= 0
 
-    # Aggregate indicators per grid cell
+    # Aggregate indicators per grid cell position; uncovered grid cells keep 0
     print_status("Aggregating INSEE indicators", "info")
-    grouped = joint.groupby("idINSPIRE")[cols_to_convert].sum().reset_index()
-
-    # Reinstate uncovered grid cells with null values replaced by 0
-    print_status("Final merge with complete grid", "info")
-    full = grid[["idINSPIRE"]].merge(grouped, on="idINSPIRE", how="left").fillna(0)
+    sums = groupsum2d(cell_idx[inside], values[inside], len(grid))
+    full = pd.DataFrame(sums, columns=cols_to_convert)
+    full.insert(0, "idINSPIRE", grid["idINSPIRE"].to_numpy())
 
     # Export the aggregated data
     full.to_csv(path_out, index=False)
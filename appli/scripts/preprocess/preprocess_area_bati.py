@@ -6,43 +6,51 @@ Date : June 2025
 Usage : Preprocessing step for calculating built surface area in the modeling pipeline.
 """
 
-import geopandas as gpd  
+import numpy as np
 import pandas as pd      
 import os               
-from appli.scripts.features.features_utils import load_config, print_status  
+import shapely
+from appli.scripts.features.features_utils import load_config, print_status, load_grid, load_topo, query_grid
 
 def compute_surface_batie():
     config = load_config()  # Load project configuration
-    departement = config["departement"]
     maillage = config["maillage"]
 
-    # Define input and output file paths
-    path_grid = f"appli/output/grid/grid_{departement}_{maillage}m.geojson"
-    path_bati = "appli/data/topo/BATIMENT.shp"
+    # Define output file path
     path_out = f"appli/data/features/surf_batie_{maillage}m.csv"
 
     print_status("Loading data", "info")
-    # Load spatial grid and buildings, reprojected to EPSG:2154
-    grid = gpd.read_file(path_grid).to_crs("EPSG:2154")
-    bati = gpd.read_file(path_bati).to_crs("EPSG:2154")
-
-    # Optional: filter empty entities or those with no surface area
-    bati = bati[bati.geometry.area > 1]
+    # Load the spatial grid and the buildings within its extent, both in EPSG:2154
+    # (buildings read from the reprojected GeoParquet cache of BATIMENT.shp)
+    grid = load_grid()
+    bati = load_topo("BATIMENT", columns=[], bbox=tuple(grid.total_bounds))
 
     print_status("Calculating individual building surfaces", "info")
-    # Compute the surface area of each building
-    bati["surf"] = bati.geometry.area
+    # Compute the surface area of each building and filter empty entities or those with no surface area
+    surf = shapely.area(bati.geometry.values)
+    keep = surf > 1
+    bati, surf = bati[keep], surf[keep]
 
     print_status("Spatial intersection buildings → grid", "info")
-    # Compute spatial intersection between the grid and buildings
-    intersected = gpd.overlay(grid, bati, how="intersection")
+    # Building / grid cell pairs that intersect, from the grid spatial index
+    bati_idx, cell_idx = query_grid(grid, bati.geometry.values, predicate="intersects")
+
+    # Built surface of each pair: buildings lying wholly inside their cell keep their full area,
+    # the others are clipped element-wise in a single GEOS call (no overlay result is materialised)
+    batiments = bati.geometry.values.take(bati_idx)
+    cellules = grid.geometry.values.take(cell_idx)
+    surf_partielle = surf.take(bati_idx)
+    coupes = ~shapely.contains(cellules, batiments)
+    surf_partielle[coupes] = shapely.area(shapely.intersection(batiments[coupes], cellules[coupes]))
 
     # Calculate built surface area per grid cell (sum of intersected portions)
     print_status("Aggregating by grid cell", "info")
-    intersected["surf_partielle"] = intersected.geometry.area
-    # Aggregate built surface area by grid cell (idINSPIRE)
-    surface = intersected.groupby("idINSPIRE")["surf_partielle"].sum().reset_index()
-    surface.rename(columns={"surf_partielle": "surf_batie"}, inplace=True)
+    surf_batie = np.bincount(cell_idx, weights=surf_partielle, minlength=len(grid))
+    cells = np.flatnonzero(surf_batie > 0)  # Cells merely touched by a building are left out, as with overlay
+    surface = pd.DataFrame({
+        "idINSPIRE": grid["idINSPIRE"].to_numpy().take(cells),
+        "surf_batie": surf_batie[cells],
+    })
 
     # Create the output directory if needed
     os.makedirs("appli/data/features", exist_ok=True)
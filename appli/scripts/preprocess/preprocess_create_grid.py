@@ -10,7 +10,7 @@ import geopandas as gpd
 import numpy as np       
 import yaml
 import os               
-from shapely.geometry import box  
+import shapely
 from appli.scripts.preprocess.preprocess_utils import load_config, print_status 
 
 # Create a grid of square polygons
@@ -20,8 +20,11 @@ def create_grid(bounds, cell_size):
     # Generate coordinates for rows and columns of the grid
     rows = np.arange(ymin, ymax, cell_size)
     cols = np.arange(xmin, xmax, cell_size)
-    # Create a list of square polygons for each grid cell
-    polygons = [box(x, y, x + cell_size, y + cell_size) for x in cols for y in rows]
+    # Create the square polygons of all grid cells in a single vectorized call
+    # (column by column, then row by row within each column)
+    x, y = np.meshgrid(cols, rows, indexing="ij")
+    x, y = x.ravel(), y.ravel()
+    polygons = shapely.box(x, y, x + cell_size, y + cell_size)
     # Return a GeoDataFrame with all grid cells
     return gpd.GeoDataFrame(geometry=polygons, crs="EPSG:2154")
 
@@ -34,7 +37,7 @@ def main():
 
     try:
         # Load department geometry from an online GeoJSON file
-        dep = gpd.read_file("https://raw.githubusercontent.com/gregoiredavid/france-geojson/master/departements-version-simplifiee.geojson")
+        dep = gpd.read_file("https://raw.githubusercontent.com/gregoiredavid/france-geojson/master/departements-version-simplifiee.geojson", engine="pyogrio", use_arrow=True)
         dep = dep[dep["code"] == departement].to_crs("EPSG:2154")
         if dep.empty:
             raise ValueError("Department not found.")
@@ -42,8 +45,11 @@ def main():
         # Retrieve department bounds to create the grid
         bounds = dep.total_bounds
         grid = create_grid(bounds, cell_size)
-        # Keep only cells that intersect the department
-        grid = grid[grid.intersects(dep.geometry.squeeze())]
+        # Keep only cells that intersect the department, tested in one vectorized call against the
+        # prepared department geometry (its edges are indexed once for all the cells)
+        dep_geom = dep.geometry.union_all()
+        shapely.prepare(dep_geom)
+        grid = grid[shapely.intersects(grid.geometry.values, dep_geom)]
         # Assign a unique identifier to each grid cell
         grid["idINSPIRE"] = grid.index.astype(str)
 
@@ -51,7 +57,9 @@ def main():
         os.makedirs("appli/output/grid", exist_ok=True)
         output = f"appli/output/grid/grid_{departement}_{cell_size}m.geojson"
         # Save the grid as a GeoJSON file
-        grid.to_file(output, driver="GeoJSON")
+        grid.to_file(output, driver="GeoJSON", engine="pyogrio")
+        # GeoParquet copy (EPSG:2154), read by the feature scripts without parsing the GeoJSON
+        grid.to_parquet(output.replace(".geojson", ".parquet"))
         print_status("Grid saved", "ok", output)
 
     except Exception as e:
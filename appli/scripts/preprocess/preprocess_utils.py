@@ -1,5 +1,8 @@
+import functools
 import yaml
 
+# Parsed once per process: every script of the pipeline reads the same settings file
+@functools.lru_cache(maxsize=None)
 def load_config(path="appli/config/settings.yaml"):
     with open(path, "r") as f:
         return yaml.safe_load(f)
@@ -1,4 +1,14 @@
+import json
+import os
+import libarchive
+import numpy as np
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+import shapely
 import yaml
+from pyproj import CRS
 
 def load_config(path="config/settings.yaml"):
     with open(path, "r") as f:
@@ -11,3 +21,71 @@ def print_status(step: str, status: str = "ok", detail: str = ""):
     if detail:
         message += f" : {detail}"
     print(message)
+
+def extract_archive(path, dest_dir, include=None):
+    # Extract an archive (.7z, .zip, ...) through libarchive, streaming each entry to disk block by block,
+    # and return the paths written. include(pathname) -> bool restricts the extraction to matching entries.
+    # Entries are written relative to dest_dir without changing the working directory, so concurrent
+    # extractions in worker threads do not interfere.
+    root = os.path.abspath(dest_dir)
+    written = []
+    with libarchive.file_reader(path) as archive:
+        for entry in archive:
+            if include is not None and not include(entry.pathname):
+                continue
+            target = os.path.abspath(os.path.join(root, entry.pathname))
+            if os.path.commonpath([root, target]) != root:
+                continue  # Ignore entries pointing outside dest_dir
+            if entry.isdir:
+                os.makedirs(target, exist_ok=True)
+            elif entry.isfile:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, "wb") as f:
+                    for block in entry.get_blocks():
+                        f.write(block)
+                written.append(target)
+    return written
+
+def read_shapefile_arrow(path):
+    # Read a vector file as (CRS, Arrow table) with pyogrio, its WKB geometry column renamed "geometry"
+    meta, table = pyogrio.read_arrow(path)
+    geom_name = meta["geometry_name"] or "wkb_geometry"
+    i = table.schema.get_field_index(geom_name)
+    table = table.set_column(i, pa.field("geometry", pa.binary()), table.column(i).cast(pa.binary()))
+    return meta["crs"], table
+
+def geoparquet_metadata(crs, geometry_types=(), bbox: bool = False):
+    # GeoParquet "geo" metadata for a WKB "geometry" column.
+    # With bbox=True, also declares the GeoParquet 1.1 "bbox" covering column.
+    column = {
+        "encoding": "WKB",
+        "geometry_types": list(geometry_types),
+        "crs": CRS.from_user_input(crs).to_json_dict(),
+    }
+    if bbox:
+        column["covering"] = {"bbox": {k: ["bbox", k] for k in ("xmin", "ymin", "xmax", "ymax")}}
+    return {
+        "version": "1.1.0" if bbox else "1.0.0",
+        "primary_column": "geometry",
+        "columns": {"geometry": column},
+    }
+
+def write_geoparquet_hilbert(table: pa.Table, path, crs, geometry_types=(), row_group_size=100_000):
+    # Write an Arrow table with a WKB "geometry" column to GeoParquet, sorted along a Hilbert curve and
+    # with a bbox covering column, so that each row group covers a compact area and bbox-filtered reads
+    # can skip the others. Written to a temporary file first, then moved over path.
+    geoms = shapely.from_wkb(table["geometry"].to_numpy(zero_copy_only=False))
+    order = np.argsort(gpd.GeoSeries(geoms).hilbert_distance(level=16).to_numpy(), kind="stable")
+    table = table.take(order)
+
+    bounds = shapely.bounds(geoms[order])
+    bbox = pa.StructArray.from_arrays(
+        [pa.array(bounds[:, i]) for i in range(4)], names=["xmin", "ymin", "xmax", "ymax"]
+    )
+    table = table.append_column("bbox", bbox)
+    metadata = geoparquet_metadata(crs, geometry_types, bbox=True)
+    table = table.replace_schema_metadata({b"geo": json.dumps(metadata).encode()})
+
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path, compression="brotli", row_group_size=row_group_size)
+    os.replace(tmp_path, path)
@@ -9,9 +9,9 @@ Usage : This script is called by acquisition_pipeline.py to automate the acquisi
 
 import os
 import requests
-from io import BytesIO
 import zipfile
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from modele.scripts.acquisition.acquisition_utils import load_config, print_status
 
 # === SCRIPT PARAMETERS ===
@@ -20,6 +20,7 @@ CACHE_DIR = "modele/cache"
 FINAL_DIR = "modele/data/mobiliscope"
 EXTRACTED_FOLDER_NAME = "20230706_opendata"
 EXTRACTED_PATH = os.path.join(CACHE_DIR, EXTRACTED_FOLDER_NAME)
+ZIP_PATH = os.path.join(CACHE_DIR, "mobiliscope.zip")
 
 # List of cities to exclude (outside metropolitan France or irrelevant)
 EXCLUDE_CITIES = [
@@ -29,8 +30,19 @@ EXCLUDE_CITIES = [
 ]
 
 
+# Hardlinks src to dst (no byte copy on the same filesystem), falling back to a copy across devices
+def link_or_copy(src, dst):
+    if os.path.exists(dst):
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
 # Moves GeoJSON and CSV files of interest from subfolders of each city to the final folder
 def move_files_from_france(extract_dir, final_dir):
+    pairs = []
     for city in os.listdir(extract_dir):
         city_path = os.path.join(extract_dir, city)
 
@@ -44,12 +56,16 @@ def move_files_from_france(extract_dir, final_dir):
         geojson_src = os.path.join(city_path, "layers", "secteurs.geojson")
         csv_src = os.path.join(city_path, "stacked", "pop_choro_stacked.csv")
 
-        # Copy files if they exist
+        # Keep files that exist
         if os.path.exists(geojson_src):
-            shutil.copy2(geojson_src, os.path.join(final_dir, f"{city.lower()}_secteurs.geojson"))
+            pairs.append((geojson_src, os.path.join(final_dir, f"{city.lower()}_secteurs.geojson")))
 
         if os.path.exists(csv_src):
-            shutil.copy2(csv_src, os.path.join(final_dir, f"{city.lower()}_pop_choro_stacked.csv"))
+            pairs.append((csv_src, os.path.join(final_dir, f"{city.lower()}_pop_choro_stacked.csv")))
+
+    # Link (or copy across devices) all files concurrently: the work is I/O-bound syscalls
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda pair: link_or_copy(*pair), pairs))
 
 
 # Downloads the Mobiliscope archive, extracts it, and filters useful files
@@ -65,13 +81,17 @@ def download_mobiliscope():
 
     print_status("Downloading Mobiliscope", "info")
     try:
-        # Download the ZIP file
-        response = requests.get(MOBILISCOPE_URL, timeout=30)
-        response.raise_for_status()
+        # Stream the ZIP file to disk
+        with requests.get(MOBILISCOPE_URL, stream=True, timeout=30) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            with open(ZIP_PATH, "wb") as f:
+                shutil.copyfileobj(r.raw, f)
 
         # Extract into the cache folder
-        with zipfile.ZipFile(BytesIO(response.content)) as archive:
+        with zipfile.ZipFile(ZIP_PATH) as archive:
             archive.extractall(path=CACHE_DIR)
+        os.remove(ZIP_PATH)
 
         print_status("Extraction completed", "ok")
 
@@ -7,8 +7,13 @@ Date : June 2025
 Usage : This script is called by acquisition_pipeline.py to automate the acquisition of OSM data.
 """
 
+import asyncio
 import os
 import requests
+import numpy as np
+import orjson
+import pandas as pd
+import shapely
 import geopandas as gpd
 from typing import Optional, Literal
 from modele.scripts.acquisition.acquisition_utils import load_config, print_status
@@ -20,6 +25,8 @@ REGIONS_GEOJSON = "https://raw.githubusercontent.com/gregoiredavid/france-geojso
 TAGS = ["building", "shop", "office", "amenity", "leisure"]
 TAGS_EXTRA = ["building:levels", "building:use", "building:material", "building:roof:shape", "name", "operator"]
 CRS = "EPSG:4326"
+# Cached region bounds; kept outside modele/cache, which is emptied at the end of each acquisition run
+REGIONS_BBOX_CACHE = os.path.join(OUTPUT_DIR, "regions_metro_bbox.json")
 
 # Saves a GeoDataFrame in GeoParquet format with compression
 def save_geoparquet(
@@ -31,9 +38,9 @@ def save_geoparquet(
     gdf.to_parquet(path, compression=compression, index=False)
 
 
-# Retrieves the geographic bounds of metropolitan France from the simplified GeoJSON file
-def get_bbox_france_metropolitaine():
-    france = gpd.read_file(REGIONS_GEOJSON).to_crs(CRS)
+# Retrieves the metropolitan regions from the simplified GeoJSON file
+def get_regions_france_metropolitaine():
+    france = gpd.read_file(REGIONS_GEOJSON, engine="pyogrio", use_arrow=True).to_crs(CRS)
 
     # INSEE codes for metropolitan regions only
     codes_metro = ["84", "27", "53", "24", "94", "44", "32", "11", "28", "75", "76", "52"]
@@ -41,20 +48,32 @@ def get_bbox_france_metropolitaine():
 
     if france_metro.empty:
         raise ValueError("Metropolitan France not found.")
-    return france_metro.total_bounds
+    return france_metro
 
 
-# Builds an Overpass query (in OverpassQL language) for the given tags and bbox
+# Bounding boxes (minx, miny, maxx, maxy) of the metropolitan regions, read from the local cache
+# when present; the regions GeoJSON is only downloaded to build it
+def get_region_bboxes():
+    if os.path.exists(REGIONS_BBOX_CACHE):
+        with open(REGIONS_BBOX_CACHE, "rb") as f:
+            return orjson.loads(f.read())
+
+    bboxes = get_regions_france_metropolitaine().geometry.bounds.to_numpy().tolist()
+    with open(REGIONS_BBOX_CACHE, "wb") as f:
+        f.write(orjson.dumps(bboxes))
+    return bboxes
+
+
+# Builds an Overpass query (in OverpassQL language) for the given tags and bbox.
+# All tag families are matched by a single key regex on nwr (node/way/relation).
 def build_overpass_query(bbox):
     minx, miny, maxx, maxy = bbox
     bbox_str = f"{miny},{minx},{maxy},{maxx}"
+    tags_regex = "|".join(TAGS)
 
     query = "[out:json][timeout:180];(\n"
-    for tag in TAGS:
-        query += f'  node["{tag}"]({bbox_str});\n'
-        query += f'  way["{tag}"]({bbox_str});\n'
-        query += f'  relation["{tag}"]({bbox_str});\n'
-    query += ");\nout body;\n>;\nout skel qt;"
+    query += f'  nwr[~"^({tags_regex})$"~"."]({bbox_str});\n'
+    query += ");\nout geom;"
     return query
 
 
@@ -62,54 +81,71 @@ def build_overpass_query(bbox):
 def fetch_osm_data(query):
     response = requests.post(OVERPASS_URL, data={"data": query}, timeout=180)
     response.raise_for_status()
-    return response.json()
+    return orjson.loads(response.content)
 
 
-# Converts OSM JSON elements into GeoDataFrames, grouped by main tag
-def overpass_to_geodataframes_by_tag(data):
-    elements = data.get("elements", [])
-    nodes = {el["id"]: el for el in elements if el["type"] == "node"}
+# Fetches every region bbox concurrently, at most max_concurrency requests in flight
+# (Overpass only grants a couple of slots per IP), and merges the elements.
+# Elements straddling two regions are returned twice and deduplicated on (type, id).
+async def fetch_osm_by_region(bboxes, max_concurrency=2):
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch(bbox):
+        async with semaphore:
+            return await asyncio.to_thread(fetch_osm_data, build_overpass_query(bbox))
+
+    results = await asyncio.gather(*(fetch(bbox) for bbox in bboxes))
+
+    elements = {}
+    for data in results:
+        for el in data.get("elements", []):
+            elements.setdefault((el["type"], el["id"]), el)
+    return {"elements": list(elements.values())}
 
+
+# Converts OSM JSON elements into GeoDataFrames, grouped by main tag.
+# With "out geom" each way carries its own coordinates, so geometries are built
+# in one vectorized shapely call per tag instead of resolving node ids in Python.
+def overpass_to_geodataframes_by_tag(data):
     grouped = {tag: [] for tag in TAGS}
 
-    for el in elements:
-        if "tags" not in el:
+    for el in data.get("elements", []):
+        if "tags" not in el or el["type"] not in ("node", "way"):
             continue
+        if el["type"] == "way" and len(el.get("geometry", [])) < 3:
+            continue  # Pas suffisant pour un polygone
 
         # Détecte le tag principal de l'élément
         tag_type = next((k for k in TAGS if k in el["tags"]), None)
-        if tag_type is None:
-            continue
+        if tag_type is not None:
+            grouped[tag_type].append(el)
 
-        # Crée la géométrie : Point pour node, Polygon pour way
-        if el["type"] == "node":
-            geom = {"type": "Point", "coordinates": [el["lon"], el["lat"]]}
-        elif el["type"] == "way":
-            coords = [
-                [nodes[nid]["lon"], nodes[nid]["lat"]]
-                for nid in el.get("nodes", [])
-                if nid in nodes
-            ]
-            if len(coords) < 3:
-                continue  # Pas suffisant pour un polygone
-            geom = {"type": "Polygon", "coordinates": [coords]}
-        else:
+    gdfs = {}
+    for tag, els in grouped.items():
+        if not els:
             continue
 
-        # Ne conserve que les tags intéressants
-        filtered_tags = {k: v for k, v in el["tags"].items() if k in TAGS + TAGS_EXTRA}
-
-        grouped[tag_type].append({
-            "type": "Feature",
-            "geometry": geom,
-            "properties": filtered_tags
-        })
-
-    # Convertit chaque groupe en GeoDataFrame
-    gdfs = {
-        tag: gpd.GeoDataFrame.from_features(features, crs=CRS)
-        for tag, features in grouped.items() if features
-    }
+        # Crée la géométrie : Point pour node, Polygon pour way
+        is_node = np.fromiter((el["type"] == "node" for el in els), dtype=bool, count=len(els))
+        geoms = np.empty(len(els), dtype=object)
+
+        nodes = [el for el, node in zip(els, is_node) if node]
+        if nodes:
+            lons = np.fromiter((el["lon"] for el in nodes), dtype=float, count=len(nodes))
+            lats = np.fromiter((el["lat"] for el in nodes), dtype=float, count=len(nodes))
+            geoms[is_node] = shapely.points(lons, lats)
+
+        ways = [el for el, node in zip(els, ~is_node) if node]
+        if ways:
+            sizes = np.fromiter((len(el["geometry"]) for el in ways), dtype=np.int64, count=len(ways))
+            coords = np.array([(pt["lon"], pt["lat"]) for el in ways for pt in el["geometry"]], dtype=float)
+            rings = shapely.linearrings(coords, indices=np.repeat(np.arange(len(ways)), sizes))
+            geoms[~is_node] = shapely.polygons(rings)
+
+        # Ne conserve que les tags intéressants (projetés élément par élément, une liste par tag)
+        props = pd.DataFrame({k: [el["tags"].get(k) for el in els] for k in TAGS + TAGS_EXTRA})
+        props = props.dropna(axis=1, how="all")
+        gdfs[tag] = gpd.GeoDataFrame(props, geometry=geoms, crs=CRS)
     return gdfs
 
 
@@ -119,9 +155,9 @@ def download_osm():
     print_status("Downloading OSM data", "info")
 
     try:
-        bbox = get_bbox_france_metropolitaine()
-        query = build_overpass_query(bbox)
-        data = fetch_osm_data(query)
+        # One Overpass query per region bbox instead of a single country-wide request
+        bboxes = get_region_bboxes()
+        data = asyncio.run(fetch_osm_by_region(bboxes))
         gdfs_by_tag = overpass_to_geodataframes_by_tag(data)
 
         # Save filtered GeoDataFrames
@@ -9,13 +9,15 @@ Usage : This script is called by acquisition_pipeline.py to automate the acquisi
 
 import os
 import requests
-import py7zr
 import zipfile
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
 import warnings
 from typing import Optional, Literal
-from modele.scripts.acquisition.acquisition_utils import print_status, load_config
+from modele.scripts.acquisition.acquisition_utils import print_status, load_config, extract_archive, read_shapefile_arrow
 
 # === SCRIPT PARAMETERS ===
 URL_SHAPE = "https://www.insee.fr/fr/statistiques/fichier/6214726/grille200m_shp.7z"
@@ -61,8 +63,7 @@ def download_and_extract(url, dest_dir):
     # Extraction based on file extension
     try:
         if filename.endswith(".7z"):
-            with py7zr.SevenZipFile(local_path, mode='r') as archive:
-                archive.extractall(path=dest_dir)
+            extract_archive(local_path, dest_dir)
         elif filename.endswith(".zip"):
             with zipfile.ZipFile(local_path, 'r') as archive:
                 archive.extractall(dest_dir)
@@ -74,6 +75,17 @@ def download_and_extract(url, dest_dir):
         print_status(f"Error during extraction of {filename}: {e}", "err")
 
 
+# Reads a CSV as an Arrow table with every column as string, through PyArrow's multi-threaded CSV reader.
+# The column types are given to the reader itself (not converted afterwards), so codes such as
+# "0100" keep their leading zeros, and empty fields become NaN as with pd.read_csv(dtype=str).
+def read_csv_as_str(path):
+    columns = pd.read_csv(path, nrows=0).columns
+    convert_options = pv.ConvertOptions(
+        column_types=dict.fromkeys(columns, pa.string()), strings_can_be_null=True
+    )
+    return pv.read_csv(path, convert_options=convert_options)
+
+
 # Downloads and joins census data with geographic grids
 def download_recens(metropole=False):
     config = load_config("config/settings.yaml")
@@ -101,23 +113,31 @@ def download_recens(metropole=False):
             print_status("Required files missing after extraction", "err")
             return
 
-        gdf = gpd.read_file(gdf_path)
-        df = pd.read_csv(df_path, sep=',', dtype=str)
+        crs, grid = read_shapefile_arrow(gdf_path)
+        df = read_csv_as_str(df_path)
     except Exception as e:
         print_status(f"Error during file loading: {e}", "err")
         return
 
     # Check that the join key is present
-    if "lcog_geo" not in df.columns:
+    if "lcog_geo" not in df.column_names:
         print_status("Column 'lcog_geo' missing in CSV", "err")
         return
 
     # Join the geographic layer with attribute data
     print_status("Attribute join", "info")
-    gdf = gdf.rename(columns={"idINSPIRE": "id_car200m"})
-    df = df.rename(columns={"idcar_200m": "id_car200m"})
-
-    gdf_joined = gdf.merge(df, on="id_car200m", how="inner")
+    grid = grid.rename_columns(["id_car200m" if c == "idINSPIRE" else c for c in grid.column_names])
+    df = df.rename_columns(["id_car200m" if c == "idcar_200m" else c for c in df.column_names])
+
+    # Multi-threaded Arrow hash join, reordered as the pandas inner merge was (grid rows, then CSV rows)
+    grid = grid.append_column("_row", pa.array(np.arange(grid.num_rows)))
+    df = df.append_column("_row_csv", pa.array(np.arange(df.num_rows)))
+    joined = grid.join(df, keys="id_car200m", join_type="inner", left_suffix="_x", right_suffix="_y")
+    joined = joined.sort_by([("_row", "ascending"), ("_row_csv", "ascending")]).drop_columns(["_row", "_row_csv"])
+
+    # Convert to a GeoDataFrame only once the join is done
+    geometry = gpd.GeoSeries.from_wkb(joined["geometry"].to_numpy(zero_copy_only=False), crs=crs)
+    gdf_joined = gpd.GeoDataFrame(joined.drop_columns(["geometry"]).to_pandas(), geometry=geometry)
 
     # Save the result in GeoParquet format
     print_status("Saving joined layer in GeoParquet format", "info")
@@ -7,62 +7,127 @@ Date : June 2025
 Usage : This script is called by acquisition_pipeline.py to automate the acquisition of SIRENE establishments.
 """
 
+import json
 import os
+import shutil
 import pandas as pd
 import requests
-import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import numpy as np
-from zipfile import ZipFile
-from io import BytesIO
+import shapely
+from zipfile import BadZipFile, ZipFile
 from tqdm import tqdm
-from typing import Optional, Literal
-from shapely.geometry import Point
-from modele.scripts.acquisition.acquisition_utils import load_config, print_status
+from typing import Optional
+from modele.scripts.acquisition.acquisition_utils import (
+    load_config, print_status, geoparquet_metadata, write_geoparquet_hilbert
+)
 
 # === SCRIPT PARAMETERS ===
 SIRENE_URL = "https://www.data.gouv.fr/fr/datasets/r/0651fb76-bcf3-4f6a-a38d-bc04fa708576"
 OUTPUT_DIR = "modele/data/raw"
 CACHE_DIR = "modele/cache"
 OUTPUT_PATH = os.path.join(OUTPUT_DIR, "sirene.parquet")
+ZIP_PATH = os.path.join(CACHE_DIR, "sirene.zip")
 CHUNK_SIZE = 100_000
 
 
-# Saves a GeoDataFrame in GeoParquet format with append option
-def save_geoparquet(
-    gdf: gpd.GeoDataFrame,
-    path: str,
-    compression: Optional[Literal['snappy', 'gzip', 'brotli']] = "brotli",
-    append: bool = False
-):
-    # If append = True and file already exists: concatenate the old and new data
-    if append and os.path.exists(path):
-        existing = gpd.read_parquet(path)
-        gdf_concat = pd.concat([existing, gdf], ignore_index=True)
-        gdf = gpd.GeoDataFrame(gdf_concat, geometry=existing.geometry.name, crs=existing.crs)
+# Converts a chunk and its point geometries into an Arrow table with a WKB geometry column
+def chunk_to_arrow(chunk: pd.DataFrame, geoms, schema: Optional[pa.Schema] = None):
+    table = pa.Table.from_pandas(chunk, preserve_index=False)
+    table = table.append_column("geometry", pa.array(shapely.to_wkb(geoms), type=pa.binary()))
+    if schema is None:
+        metadata = {b"geo": json.dumps(geoparquet_metadata("EPSG:2154", ["Point"])).encode()}
+        return table.replace_schema_metadata(metadata)
+    return table.cast(schema)
 
-    gdf.to_parquet(path, compression=compression, index=False)
 
+# Rewrites the SIRENE GeoParquet file sorted along a Hilbert curve, with a bbox covering column
+def sort_geoparquet_hilbert(path, row_group_size=100_000):
+    write_geoparquet_hilbert(pq.read_table(path), path, "EPSG:2154", ["Point"], row_group_size)
 
-# Main function: downloads and processes SIRENE data
-def download_sirene():
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    print_status("Downloading SIRENE", "info")
-    try:
-        r = requests.get(SIRENE_URL, timeout=60)
+# Total size of the remote archive announced by a response, or None if it cannot be known
+def remote_size(r):
+    content_range = r.headers.get("Content-Range", "")
+    if "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    if r.status_code == 200 and "Content-Encoding" not in r.headers and "Content-Length" in r.headers:
+        return int(r.headers["Content-Length"])
+    return None
+
+
+# Deletes the archive and its stored validator so the next download starts from scratch
+def remove_sirene_zip(path):
+    for p in (path, path + ".validator"):
+        if os.path.exists(p):
+            os.remove(p)
+
+
+# Fetches the SIRENE archive once, resuming a partial download when its validator is known.
+# Returns True when the archive on disk has the size announced by the server.
+def fetch_sirene_zip(path):
+    validator_path = path + ".validator"
+    validator = None
+    if os.path.exists(path) and os.path.exists(validator_path):
+        with open(validator_path) as f:
+            validator = f.read().strip() or None
+
+    # Without a validator the partial file cannot be trusted, so it is downloaded again
+    offset = os.path.getsize(path) if validator else 0
+    headers = {"Range": f"bytes={offset}-", "If-Range": validator} if offset else {}
+
+    with requests.get(SIRENE_URL, headers=headers, stream=True, timeout=60) as r:
+        total = remote_size(r)
+
+        # 416: the range starts past the end, which is only fine if the archive is exactly complete
+        if r.status_code == 416:
+            return total == offset
         r.raise_for_status()
-    except requests.RequestException as e:
-        print_status("Downloading SIRENE", "err", str(e))
-        return
 
+        # 206: If-Range matched, the remote archive is unchanged and only its tail is sent;
+        # 200: the archive changed (or ranges are unsupported) and is sent again in full
+        resumed = r.status_code == 206
+        if resumed and not r.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+            return False
+
+        # Store the validator before writing, so an interrupted download can be resumed safely.
+        # Weak ETags are not allowed in If-Range, Last-Modified is used instead.
+        etag = r.headers.get("ETag")
+        new_validator = etag if etag and not etag.startswith("W/") else r.headers.get("Last-Modified")
+        if new_validator:
+            with open(validator_path, "w") as f:
+                f.write(new_validator)
+        elif os.path.exists(validator_path):
+            os.remove(validator_path)
+
+        r.raw.decode_content = True
+        with open(path, "ab" if resumed else "wb") as f:
+            shutil.copyfileobj(r.raw, f, length=1 << 20)
+    return total is None or os.path.getsize(path) == total
+
+
+# Streams the SIRENE archive to disk, resuming a partial download with a Range request.
+# On a size mismatch the archive is deleted and downloaded again once from scratch.
+def download_sirene_zip(path):
+    for attempt in range(2):
+        if fetch_sirene_zip(path):
+            return path
+        remove_sirene_zip(path)
+    raise IOError("SIRENE archive size does not match the size announced by the server")
+
+
+# Converts the SIRENE CSV of the archive into a Hilbert-sorted GeoParquet file
+def convert_sirene_zip(zip_path):
     # Deletes the old output file if it exists
     if os.path.exists(OUTPUT_PATH):
         os.remove(OUTPUT_PATH)
 
+    writer = None
     try:
-        # Directly read the ZIP in memory
-        with ZipFile(BytesIO(r.content)) as z:
+        # Stream the CSV out of the ZIP on disk
+        with ZipFile(zip_path) as z:
             with z.open("StockEtablissement_utf8.csv") as csv_file:
 
                 # Read in chunks to avoid saturating RAM
@@ -73,25 +138,64 @@ def download_sirene():
                     chunk["longitude"] = pd.to_numeric(chunk["coordonneeLambertAbscisseEtablissement"], errors="coerce")
                     chunk["latitude"] = pd.to_numeric(chunk["coordonneeLambertOrdonneeEtablissement"], errors="coerce")
 
-                    # Filter rows with valid coordinates
-                    chunk_geo = chunk.dropna(subset=["longitude", "latitude"])
-                    chunk_geo = chunk_geo[np.isfinite(chunk_geo["longitude"]) & np.isfinite(chunk_geo["latitude"])]
-                    if chunk_geo.empty:
+                    # Filter rows with valid coordinates (a single finite mask also drops NaN)
+                    x = chunk["longitude"].to_numpy()
+                    y = chunk["latitude"].to_numpy()
+                    valid = np.isfinite(x) & np.isfinite(y)
+                    if not valid.any():
                         continue
+                    chunk_geo = chunk[valid]
+
+                    # Create point geometries in one vectorized call (coordinates are Lambert 93)
+                    geoms = shapely.points(x[valid], y[valid])
+
+                    # Append the chunk to the single open Parquet file
+                    if writer is None:
+                        table = chunk_to_arrow(chunk_geo, geoms)
+                        writer = pq.ParquetWriter(OUTPUT_PATH, table.schema, compression="brotli")
+                    else:
+                        table = chunk_to_arrow(chunk_geo, geoms, writer.schema)
+                    writer.write_table(table)
+
+        if writer is not None:
+            writer.close()
+            writer = None
 
-                    # Create point geometry
-                    chunk_geo["geometry"] = chunk_geo.apply(
-                        lambda row: Point(row["longitude"], row["latitude"]), axis=1
-                    )
-                    chunk_geo = gpd.GeoDataFrame(chunk_geo, geometry="geometry", crs="EPSG:4326")
+            # Spatially sort the establishments for row-group pruning
+            sort_geoparquet_hilbert(OUTPUT_PATH)
 
-                    # Save the chunk in append mode
-                    save_geoparquet(chunk_geo, OUTPUT_PATH, append=True)
+    finally:
+        if writer is not None:
+            writer.close()
 
-        print_status("SIRENE downloaded and saved in GeoParquet format", "ok")
 
-    except Exception as e:
-        print_status("Processing SIRENE data", "err", str(e))
+# Main function: downloads and processes SIRENE data
+def download_sirene():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    # A corrupt archive (truncated, or spliced from two versions) is deleted and fetched again once
+    for attempt in range(2):
+        print_status("Downloading SIRENE", "info")
+        try:
+            download_sirene_zip(ZIP_PATH)
+        except (requests.RequestException, IOError) as e:
+            print_status("Downloading SIRENE", "err", str(e))
+            return
+
+        try:
+            convert_sirene_zip(ZIP_PATH)
+            print_status("SIRENE downloaded and saved in GeoParquet format", "ok")
+            return
+        except BadZipFile as e:
+            remove_sirene_zip(ZIP_PATH)
+            if attempt:
+                print_status("Processing SIRENE data", "err", f"corrupt archive ({e})")
+            else:
+                print_status("Processing SIRENE data", "info", f"corrupt archive ({e}), downloading it again")
+        except Exception as e:
+            print_status("Processing SIRENE data", "err", str(e))
+            return
 
 
 # Entry point if run directly
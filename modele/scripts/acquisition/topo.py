@@ -7,17 +7,20 @@ Date : June 2025
 Usage : This script is called by acquisition_pipeline.py to automate the acquisition of BD TOPO buildings.
 """
 
+import asyncio
 import os
+import re
+import tempfile
+import time
 import requests
 import yaml
-import py7zr
 import shutil
-import geopandas as gpd
-import pandas as pd
-from io import BytesIO
+import pyarrow as pa
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from typing import Optional, Literal
-from modele.scripts.acquisition.acquisition_utils import print_status
+from modele.scripts.acquisition.acquisition_utils import (
+    print_status, extract_archive, read_shapefile_arrow, write_geoparquet_hilbert
+)
 
 # === SCRIPT PARAMETERS ===
 YAML_PATH = "utils/topo_url.yaml"
@@ -25,15 +28,7 @@ CACHE_DIR = "modele/cache"
 BATIMENT_DIR = os.path.join(CACHE_DIR, "batiments")
 OUTPUT_DIR = "modele/data/processed"
 OUTPUT_PATH = os.path.join(OUTPUT_DIR, "BATIMENT.parquet")
-
-
-# Saves a GeoDataFrame in GeoParquet format with compression
-def save_geoparquet(
-    gdf: gpd.GeoDataFrame,
-    path: str,
-    compression: Optional[Literal['snappy', 'gzip', 'brotli']] = "brotli"
-):
-    gdf.to_parquet(path, compression=compression, index=False)
+BATIMENT_ENTRY = re.compile(r"(^|/)BATIMENT\.(shp|shx|dbf|prj|cpg)$", re.IGNORECASE)
 
 
 # Loads BD TOPO URLs from a YAML file (key = department number + suffix)
@@ -43,68 +38,139 @@ def get_all_topo_urls():
     return [(key.split("_")[0], url) for key, url in topo_config["topo_url"].items()]
 
 
-# Downloads and extracts the .7z file for a given department, and copies the BATIMENT shapefile
-def download_and_extract_batiment(num_dept, url, extract_root, batiment_dir):
+# Downloads a URL to a temporary file, retrying with exponential backoff on 429/5xx responses
+# and on connection errors, timeouts and broken transfers
+def download_with_retry(url, suffix=".7z", retries=4, backoff=2.0, timeout=60):
+    for attempt in range(retries + 1):
+        tmp_path = None
+        try:
+            with requests.get(url, stream=True, timeout=timeout) as r:
+                if r.status_code == 429 or r.status_code >= 500:
+                    if attempt < retries:
+                        time.sleep(backoff * 2 ** attempt)
+                        continue
+                if r.status_code != 200:
+                    raise requests.HTTPError(f"Code {r.status_code}")
+                with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=CACHE_DIR) as tmp:
+                    tmp_path = tmp.name
+                    for chunk in r.iter_content(chunk_size=1 << 20):
+                        tmp.write(chunk)
+                return tmp_path
+        except BaseException as e:
+            # A failed transfer must not leave its partial archive in the cache directory
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            retryable = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+            if not isinstance(e, retryable) or attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+# Extracts a .7z archive in its own directory and copies the BATIMENT shapefile to batiment_dir
+def extract_batiment(num_dept, archive_path, extract_root, batiment_dir):
+    # Each department gets its own extraction directory so concurrent extractions never collide
+    extract_dir = tempfile.mkdtemp(prefix=f"{num_dept}_", dir=extract_root)
     try:
-        print_status(f"Downloading {num_dept}", "info")
-        r = requests.get(url)
-        if r.status_code != 200:
-            print_status(f"Download error {url}", "err", f"Code {r.status_code}")
+        # Only the BATIMENT shapefile entries are written, selected from the archive entry names
+        extracted = extract_archive(archive_path, extract_dir, include=BATIMENT_ENTRY.search)
+        shp = next((path for path in extracted if path.lower().endswith(".shp")), None)
+        if shp is None:
             return None
 
-        # Extract the .7z from memory
-        with py7zr.SevenZipFile(BytesIO(r.content)) as archive:
-            archive.extractall(path=extract_root)
+        for src in extracted:
+            if os.path.dirname(src) == os.path.dirname(shp):
+                ext = os.path.splitext(src)[1].lower()
+                shutil.copy2(src, os.path.join(batiment_dir, f"{num_dept}_BATIMENT{ext}"))
+        return os.path.join(batiment_dir, f"{num_dept}_BATIMENT.shp")
+    finally:
+        # Cleanup extracted files (the BATIMENT copies are kept in batiment_dir)
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        os.remove(archive_path)
 
-        # Search for the BATIMENT shapefile in the directory structure
-        for root, _, files in os.walk(extract_root):
-            for file in files:
-                name, ext = os.path.splitext(file)
-                if name.upper() == "BATIMENT" and ext.lower() == ".shp":
-                    for ext2 in [".shp", ".shx", ".dbf", ".prj", ".cpg"]:
-                        src = os.path.join(root, f"BATIMENT{ext2}")
-                        if os.path.exists(src):
-                            dst = os.path.join(batiment_dir, f"{num_dept}_BATIMENT{ext2}")
-                            shutil.copy2(src, dst)
-                    return os.path.join(batiment_dir, f"{num_dept}_BATIMENT.shp")
 
-        print_status(f"No BATIMENT found in {url}", "err")
+# Downloads and extracts the .7z file for a given department, and copies the BATIMENT shapefile.
+# Blocking network and extraction work runs in worker threads; the semaphore bounds concurrency.
+async def download_and_extract_batiment(num_dept, url, extract_root, batiment_dir, semaphore, pbar=None):
+    async with semaphore:
+        try:
+            print_status(f"Downloading {num_dept}", "info")
+            archive_path = await asyncio.to_thread(download_with_retry, url)
+            shp = await asyncio.to_thread(extract_batiment, num_dept, archive_path, extract_root, batiment_dir)
+            if shp is None:
+                print_status(f"No BATIMENT found in {url}", "err")
+            return shp
 
-    except Exception as e:
-        print_status(f"Extraction error {url}", "err", str(e))
+        except Exception as e:
+            print_status(f"Download/extraction error {url}", "err", str(e))
+            return None
 
-    finally:
-        # Cleanup extracted files (except BATIMENT folder)
-        for item in os.listdir(extract_root):
-            path = os.path.join(extract_root, item)
-            try:
-                if not os.path.samefile(path, batiment_dir):
-                    if os.path.isdir(path):
-                        shutil.rmtree(path)
-                    else:
-                        os.remove(path)
-            except FileNotFoundError:
-                continue
-
-    return None
-
-
-# Merges a list of shapefiles into a single GeoDataFrame, then exports it to GeoParquet
+        finally:
+            if pbar is not None:
+                pbar.update(1)
+
+
+# Runs all department downloads concurrently, at most max_concurrency at a time
+async def download_all_batiments(urls, extract_root, batiment_dir, max_concurrency=8):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    with tqdm(total=len(urls), desc="Downloading and extracting") as pbar:
+        tasks = [
+            download_and_extract_batiment(num_dept, url, extract_root, batiment_dir, semaphore, pbar)
+            for num_dept, url in urls
+        ]
+        return await asyncio.gather(*tasks)
+
+
+# Stacks Arrow tables whose columns may differ between departments: missing columns are filled with
+# nulls, numeric types are widened, and columns with otherwise incompatible types are cast to string
+def concat_tables(tables):
+    tables = list(tables)
+    types = {}
+    for table in tables:
+        for field in table.schema:
+            types.setdefault(field.name, set()).add(field.type)
+
+    for name, field_types in types.items():
+        if len(field_types) < 2:
+            continue
+        try:
+            pa.unify_schemas([pa.schema([(name, t)]) for t in field_types], promote_options="permissive")
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            for k, table in enumerate(tables):
+                i = table.schema.get_field_index(name)
+                if i >= 0:
+                    tables[k] = table.set_column(i, name, table.column(i).cast(pa.string()))
+    return pa.concat_tables(tables, promote_options="permissive")
+
+
+# Merges a list of shapefiles into a single Arrow table, then exports it to GeoParquet (Hilbert-sorted)
 def merge_shapefiles(shapefiles, output_path):
-    gdfs = []
-    for shp in shapefiles:
+    # GDAL releases the GIL while reading, so the shapefiles are read in parallel threads
+    def read(shp):
         try:
-            gdf = gpd.read_file(shp)
-            gdfs.append(gdf)
+            return (shp, *read_shapefile_arrow(shp))
         except Exception as e:
             print_status(f"Error reading {shp}", "err", str(e))
+            return None
 
-    if gdfs:
-        merged = gpd.GeoDataFrame(pd.concat(gdfs, ignore_index=True), crs=gdfs[0].crs)
-        save_geoparquet(merged, output_path)
-        print_status(f"Merge completed: {output_path}", "ok")
-    else:
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = [r for r in executor.map(read, shapefiles) if r is not None]
+
+    if not results:
         print_status("No shapefiles to merge", "err")
+        return
+
+    # All layers must share the CRS of the first one to be stacked
+    crs = results[0][1]
+    tables = []
+    for shp, shp_crs, table in results:
+        if shp_crs != crs:
+            print_status(f"CRS mismatch, skipped {shp}", "err", f"{shp_crs} != {crs}")
+            continue
+        tables.append(table)
+
+    merged = concat_tables(tables)
+    write_geoparquet_hilbert(merged, output_path, crs)
+    print_status(f"Merge completed: {output_path}", "ok")
 
 
 # Main function: downloads, extracts, and merges all departmental BATIMENT files
@@ -113,14 +179,11 @@ def download_topo():
     os.makedirs(BATIMENT_DIR, exist_ok=True)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    shapefiles = []
     urls = get_all_topo_urls()
 
-    # Download and extract for each department
-    for num_dept, url in tqdm(urls, desc="Downloading and extracting"):
-        shp = download_and_extract_batiment(num_dept, url, CACHE_DIR, BATIMENT_DIR)
-        if shp:
-            shapefiles.append(shp)
+    # Download and extract all departments concurrently, keeping the YAML order
+    results = asyncio.run(download_all_batiments(urls, CACHE_DIR, BATIMENT_DIR))
+    shapefiles = [shp for shp in results if shp]
 
     # Final merge
     if shapefiles:
@@ -10,8 +10,9 @@ Usage : Feature generation step in the features pipeline.
 import os
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point
-from modele.scripts.features.features_utils import load_config, print_status
+import pyarrow.compute as pc
+import shapely
+from modele.scripts.features.features_utils import load_config, print_status, count_points_per_cell
 
 # === SCRIPT PARAMETERS ===
 GRID_PATH = "modele/output/grid/grid_mobiliscope_200m.parquet"
@@ -24,36 +25,33 @@ OUTPUT_PATH = "modele/output/features/densite_commerces_200m.csv"
 def compute_densite_commerces():
     print_status("Loading files", "info")
 
-    # Read input files
-    grid = gpd.read_parquet(GRID_PATH).to_crs("EPSG:2154")
-    surf = pd.read_csv(SURF_PATH)
-    sirene = gpd.read_parquet(SIRENE_PATH).to_crs("EPSG:2154")
+    # Read input files (only the columns used below)
+    grid = gpd.read_parquet(GRID_PATH, columns=["idINSPIRE", "geometry"]).to_crs("EPSG:2154")
+    surf = pd.read_csv(SURF_PATH, dtype={"idINSPIRE": str})
+    # Only establishments corresponding to sales (NAF 47) are decoded: the filter is pushed down to the parquet scan
+    naf_47 = pc.starts_with(pc.field("activitePrincipaleEtablissement"), "47")
+    commerces = gpd.read_parquet(
+        SIRENE_PATH, columns=["geometry", "longitude", "latitude"], filters=naf_47
+    ).to_crs("EPSG:2154")
 
     # Clean inherited indexes
     for df in [grid, surf]:
         if "index_right" in df.columns:
             df.drop(columns=["index_right"], inplace=True)
-    grid["idINSPIRE"] = grid["idINSPIRE"].astype(str)
-    surf["idINSPIRE"] = surf["idINSPIRE"].astype(str)
 
     # Generate geometry if absent (safety)
-    if "geometry" not in sirene.columns or sirene.geometry.is_empty.any():
-        sirene["geometry"] = sirene.apply(lambda row: Point(row["longitude"], row["latitude"]), axis=1)
-        sirene = gpd.GeoDataFrame(sirene, geometry="geometry", crs="EPSG:2154")
+    if "geometry" not in commerces.columns or commerces.geometry.is_empty.any():
+        geoms = shapely.points(commerces["longitude"].to_numpy(float), commerces["latitude"].to_numpy(float))
+        commerces = commerces.set_geometry(geoms, crs="EPSG:2154")
 
-    # Filter establishments corresponding to sales (NAF 47)
-    sirene["naf2"] = sirene["activitePrincipaleEtablissement"].astype(str).str[:2]
-    commerces = sirene[sirene["naf2"] == "47"]
-
-    # Spatial join between shops and grid cells
-    print_status("Join shops → grid", "info")
-    joint = gpd.sjoin(grid, commerces, how="left", predicate="contains")
-    count = joint.groupby("idINSPIRE").size().reset_index(name="nb_commerces")
-    count["idINSPIRE"] = count["idINSPIRE"].astype(str)
+    # Count shops per grid cell
+    print_status("Count shops per cell", "info")
+    merged = grid[["idINSPIRE"]].copy()
+    merged["nb_commerces"] = count_points_per_cell(grid, commerces.geometry)
 
     # Compute density by built surface
     print_status("Compute density", "info")
-    merged = grid[["idINSPIRE"]].merge(count, on="idINSPIRE", how="left").merge(surf, on="idINSPIRE", how="left")
+    merged = merged.merge(surf, on="idINSPIRE", how="left")
     merged = merged.fillna(0)
     merged = merged[merged["surf_batie"] > 10]  # avoid unstable divisions
     merged["densite_commerces"] = merged["nb_commerces"] / merged["surf_batie"]
@@ -9,8 +9,9 @@ Usage : Feature generation step in the features pipeline.
 
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point
-from modele.scripts.features.features_utils import load_config, print_status
+import numpy as np
+import shapely
+from modele.scripts.features.features_utils import load_config, print_status, count_points_per_cell
 
 # === SCRIPT PARAMETERS ===
 GRID_PATH = "modele/output/grid/grid_mobiliscope_200m.parquet"
@@ -23,10 +24,10 @@ OUTPUT_PATH = "modele/output/features/densite_etablissements_200m.csv"
 def compute_densite_etablissements():
     print_status("Loading files", "info")
 
-    # Read files
-    grid = gpd.read_parquet(GRID_PATH).to_crs("EPSG:2154")
-    surf = pd.read_csv(SURF_PATH)
-    sirene = gpd.read_parquet(SIRENE_PATH).to_crs("EPSG:2154")
+    # Read files (only the columns used below)
+    grid = gpd.read_parquet(GRID_PATH, columns=["idINSPIRE", "geometry"]).to_crs("EPSG:2154")
+    surf = pd.read_csv(SURF_PATH, dtype={"idINSPIRE": str})
+    sirene = gpd.read_parquet(SIRENE_PATH, columns=["geometry", "longitude", "latitude"]).to_crs("EPSG:2154")
 
     # Clean inherited columns
     for df in [grid, surf]:
@@ -35,25 +36,19 @@ def compute_densite_etablissements():
 
     # Verify or reconstruct missing geometry
     if "geometry" not in sirene.columns or sirene.geometry.is_empty.any():
-        sirene["x"] = pd.to_numeric(sirene["longitude"], errors="coerce")
-        sirene["y"] = pd.to_numeric(sirene["latitude"], errors="coerce")
-        sirene = sirene.dropna(subset=["x", "y"])
-        sirene["geometry"] = [Point(xy) for xy in zip(sirene["x"], sirene["y"])]
-        sirene = gpd.GeoDataFrame(sirene, geometry="geometry", crs="EPSG:2154")
+        x = pd.to_numeric(sirene["longitude"], errors="coerce").to_numpy(float)
+        y = pd.to_numeric(sirene["latitude"], errors="coerce").to_numpy(float)
+        valid = ~(np.isnan(x) | np.isnan(y))
+        sirene = sirene[valid].set_geometry(shapely.points(x[valid], y[valid]), crs="EPSG:2154")
 
-    # Harmonize identifiers
-    grid["idINSPIRE"] = grid["idINSPIRE"].astype(str)
-    surf["idINSPIRE"] = surf["idINSPIRE"].astype(str)
-
-    # Spatial join: attach establishments to grid cells
-    print_status("Spatial join SIRENE → grid", "info")
-    joined = gpd.sjoin(grid, sirene, how="left", predicate="contains")
-    count = joined.groupby("idINSPIRE").size().reset_index(name="nb_etabs_sirene")
-    count["idINSPIRE"] = count["idINSPIRE"].astype(str)
+    # Count establishments per grid cell
+    print_status("Count SIRENE establishments per cell", "info")
+    df = grid[["idINSPIRE"]].copy()
+    df["nb_etabs_sirene"] = count_points_per_cell(grid, sirene.geometry)
 
     # Merge with built surface area
     print_status("Merge with built surface area", "info")
-    df = grid[["idINSPIRE"]].merge(count, on="idINSPIRE", how="left").merge(surf, on="idINSPIRE", how="left")
+    df = df.merge(surf, on="idINSPIRE", how="left")
     df = df.fillna(0)
     df = df[df["surf_batie"] > 10]  # safety filter
 
@@ -9,6 +9,7 @@ Usage : Feature generation step in the features pipeline.
 
 import geopandas as gpd
 import pandas as pd
+import shapely
 import os
 from modele.scripts.features.features_utils import print_status
 
@@ -39,26 +40,17 @@ def compute_densite_voirie_optimisee():
         bbox = grid.total_bounds
         voirie = voirie.cx[bbox[0]:bbox[2], bbox[1]:bbox[3]]
 
-        # Compute road lengths (km)
-        print_status("Computing lengths...", "info")
-        voirie["longueur_km"] = voirie.geometry.length / 1000
-        grid["surface_km2"] = grid.geometry.area / 1e6
-
-        # Spatial join: roads → grid cells
+        # Spatial join: roads → grid cells (positional pairs from the grid's R-tree)
         print_status("Spatial join between roads and grid...", "info")
-        voirie = voirie.drop(columns=['index_right'], errors='ignore')
-        grid = grid.drop(columns=['index_right'], errors='ignore')
-        joined = gpd.sjoin(voirie, grid, how="inner", predicate="intersects")
-        joined = joined.rename(columns={"geometry": "geometry_voirie", "index_right": "grid_index"})
+        voirie_idx, grid_idx = grid.sindex.query(voirie.geometry.values, predicate="intersects")
 
-        # Compute exact intersections between roads and tiles
+        # Compute exact intersections between roads and tiles, in one vectorized call
         print_status("Computing geometric intersections...", "info")
-        joined["geometry"] = joined.apply(
-            lambda row: row["geometry_voirie"].intersection(grid.iloc[row["grid_index"]].geometry),
-            axis=1
-        )
-        joined["longueur_intersect_km"] = joined.geometry.length / 1000
-        joined["idINSPIRE"] = grid.iloc[joined["grid_index"]]["idINSPIRE"].values
+        inter = shapely.intersection(voirie.geometry.values.take(voirie_idx), grid.geometry.values.take(grid_idx))
+        joined = pd.DataFrame({
+            "idINSPIRE": grid["idINSPIRE"].values.take(grid_idx),
+            "longueur_intersect_km": shapely.length(inter) / 1000,
+        })
 
         # Aggregate by grid cell
         print_status("Aggregating by grid cell...", "info")
@@ -10,20 +10,34 @@ Usage : Feature generation step in the features pipeline.
 import geopandas as gpd
 import pandas as pd
 import numpy as np
+import shapely
 from shapely.geometry import box
 from scipy.spatial.distance import pdist
 from multiprocessing import cpu_count
 from tqdm.contrib.concurrent import process_map
 from modele.scripts.features.features_utils import print_status
 
-# Auxiliary function called in parallel
+# Cells with more buildings than this use a sampled estimate instead of all n(n-1)/2 pairs
+PDIST_MAX_POINTS = 500
+N_SAMPLES = 100_000
+
+
+# Auxiliary function called in parallel: mean pairwise Euclidean distance between the building
+# centroids of one grid cell. Exact (pdist) up to PDIST_MAX_POINTS buildings; beyond, unbiased
+# Monte-Carlo estimate over N_SAMPLES random pairs of distinct buildings (fixed seed, reproducible).
 def compute_mean_distance(group):
-    id_, df = group
-    coords = np.array([[pt.x, pt.y] for pt in df.geometry])
-    if len(coords) > 1:
-        return (id_, pdist(coords).mean())  # Average pairwise distances
-    else:
+    id_, coords = group
+    n = len(coords)
+    if n < 2:
         return (id_, np.nan)
+    if n <= PDIST_MAX_POINTS:
+        return (id_, pdist(coords).mean())  # Average pairwise distances
+
+    rng = np.random.default_rng(0)
+    i = rng.integers(0, n, N_SAMPLES)
+    j = rng.integers(0, n - 1, N_SAMPLES)
+    j += j >= i  # uniform over the buildings other than i
+    return (id_, np.linalg.norm(coords[i] - coords[j], axis=1).mean())
 
 
 # Main function: average distance between buildings per grid cell
@@ -48,12 +62,18 @@ def compute_distance_moyenne_batiments(grid: gpd.GeoDataFrame, bati: gpd.GeoData
 
         # Step 4: Compute average distances with parallelization
         print_status("Computing average distances", "info")
-        grouped = list(joined.groupby("idINSPIRE"))
+        # Workers receive plain (id, coordinates array) tuples, split from the cell-sorted centroids
+        ids = joined["idINSPIRE"].to_numpy()
+        order = np.argsort(ids, kind="stable")
+        ids = ids[order]
+        coords = shapely.get_coordinates(joined.geometry.values)[order]
+        boundaries = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+        grouped = list(zip(ids[np.r_[0, boundaries]], np.split(coords, boundaries))) if len(ids) else []
         results = process_map(
             compute_mean_distance,
             grouped,
             max_workers=cpu_count(),
-            chunksize=1,
+            chunksize=64,
             desc="Computing distances"
         )
 
@@ -1,6 +1,6 @@
 """
 Script : features_pipeline.py
-Objective : Sequentially execute the generation of all spatial features
+Objective : Execute in parallel the generation of all spatial features
             for each grid cell (POI score, jobs, densities, morphology, socio-demographics, etc.).
 Author : LEDERMANN Quentin
 Date : June 2025
@@ -8,6 +8,8 @@ Usage : Master pipeline of the 'features' module, to be run after preprocessing.
 """
 
 import geopandas as gpd
+from joblib import Parallel, delayed
+from multiprocessing import cpu_count
 from scripts.features.features_utils import load_config, print_status
 
 # === IMPORT DES FONCTIONS DE FEATURES ===
@@ -28,12 +30,13 @@ from modele.scripts.features.dens_voirie import compute_densite_voirie_optimisee
 from modele.scripts.features.vol_moy import compute_volume_moyen_par_maille
 
 
-# Executes a feature function and saves its result as a CSV
-def safe_run(name, func, *args):
+# Executes a feature function and saves its result as a CSV.
+# Runs in a worker process, so everything it needs (including the output path) is passed explicitly.
+def safe_run(name, output_path, func, *args):
     try:
         print_status(f"Starting: {name}", "info")
         df = func(*args)
-        df.to_csv(f"output/features/{name}_{config['maillage']}m.csv", index=False)
+        df.to_csv(output_path, index=False)
         print_status(f"{name} completed", "ok")
     except Exception as e:
         print_status(f"{name} failed", "err", str(e))
@@ -41,32 +44,42 @@ def safe_run(name, func, *args):
 
 # Main pipeline
 def main():
-    global config
     config = load_config()
     departement = config["departement"]
     maillage = config["maillage"]
 
     print_status("=== STARTING FEATURES PIPELINE ===", "info")
 
-    # Load the grid
+    # Load the grid and the layers shared by several features, once
     grid = gpd.read_file(f"output/grid/grid_{departement}_{maillage}m.geojson").to_crs("EPSG:2154")
+    recens = gpd.read_parquet("modele/data/raw/recens.parquet")
+    bati = gpd.read_parquet("modele/data/processed/BATIMENT.parquet")
+
+    features = [
+        ("score_poi_pondere", compute_score_poi_pondere, grid),
+        ("emplois_estimes_pondere", compute_emplois_estimes_pondere, grid),
+        ("densite_etablissements", compute_densite_etablissements, grid),
+        ("densite_commerces", compute_densite_commerces),
+        ("indice_mixite_fonctionnelle", compute_indice_mixite_fonctionnelle, grid),
+        ("part_population_active", compute_part_population_active, grid, recens),
+        ("part_jeunes", compute_part_jeunes, grid, recens),
+        ("shape_index_moyen", compute_shape_index_moyen, grid),
+        ("hauteur_ponderee_surface", compute_hauteur_ponderee_surface, grid),
+        ("ecart_type_hauteur", compute_ecart_type_hauteur, grid),
+        ("ecart_type_surface_batiment", compute_ecart_type_surface_batiment, grid),
+        ("distance_moyenne_batiments", compute_distance_moyenne_batiments, grid, bati),
+        ("largeur_moyenne_voirie", compute_largeur_moyenne_voirie, grid),
+        ("densite_voirie", compute_densite_voirie_optimisee),
+        ("volume_moyen_bati", compute_volume_moyen_par_maille, grid),
+    ]
 
     # === Execute features ===
-    safe_run("score_poi_pondere", compute_score_poi_pondere, grid)
-    safe_run("emplois_estimes_pondere", compute_emplois_estimes_pondere, grid)
-    safe_run("densite_etablissements", compute_densite_etablissements, grid)
-    safe_run("densite_commerces", compute_densite_commerces)
-    safe_run("indice_mixite_fonctionnelle", compute_indice_mixite_fonctionnelle, grid)
-    safe_run("part_population_active", compute_part_population_active, grid, gpd.read_parquet("modele/data/raw/recens.parquet"))
-    safe_run("part_jeunes", compute_part_jeunes, grid, gpd.read_parquet("modele/data/raw/recens.parquet"))
-    safe_run("shape_index_moyen", compute_shape_index_moyen, grid)
-    safe_run("hauteur_ponderee_surface", compute_hauteur_ponderee_surface, grid)
-    safe_run("ecart_type_hauteur", compute_ecart_type_hauteur, grid)
-    safe_run("ecart_type_surface_batiment", compute_ecart_type_surface_batiment, grid)
-    safe_run("distance_moyenne_batiments", compute_distance_moyenne_batiments, grid, gpd.read_parquet("modele/data/processed/BATIMENT.parquet"))
-    safe_run("largeur_moyenne_voirie", compute_largeur_moyenne_voirie, grid)
-    safe_run("densite_voirie", compute_densite_voirie_optimisee)
-    safe_run("volume_moyen_bati", compute_volume_moyen_par_maille, grid)
+    # The features are independent of each other: each one runs in its own worker process
+    jobs = [
+        delayed(safe_run)(name, f"output/features/{name}_{maillage}m.csv", func, *args)
+        for name, func, *args in features
+    ]
+    Parallel(n_jobs=min(len(jobs), cpu_count()), backend="loky", verbose=10)(jobs)
 
     print_status("=== FEATURES PIPELINE COMPLETED ===", "ok")
 
@@ -1,4 +1,7 @@
 import yaml
+import numpy as np
+import geopandas as gpd
+import shapely
 
 def load_config(path="config/settings.yaml"):
     with open(path, "r") as f:
@@ -11,3 +14,33 @@ def print_status(step: str, status: str = "ok", detail: str = ""):
     if detail:
         message += f" : {detail}"
     print(message)
+
+def count_points_per_cell(grid, points):
+    # Number of points falling in each grid cell, aligned on the grid rows. The grid is a regular
+    # raster of axis-aligned square cells (create_grid_secteurs), so each point is bucketed by the
+    # integer (column, row) of its cell from the grid origin instead of a spatial join.
+    bounds = shapely.bounds(grid.geometry.values)
+    width = bounds[:, 2] - bounds[:, 0]
+    height = bounds[:, 3] - bounds[:, 1]
+    size = width[0]
+    regular = (
+        np.allclose(width, size) and np.allclose(height, size)
+        and np.allclose(shapely.area(grid.geometry.values), width * height)
+    )
+    if not regular:
+        # Fallback for grids that are not made of axis-aligned squares: point-in-polygon join
+        cells = grid[["geometry"]].reset_index(drop=True)
+        joined = gpd.sjoin(gpd.GeoDataFrame(geometry=points), cells, predicate="within")
+        return np.bincount(joined["index_right"].to_numpy(), minlength=len(grid))
+
+    x0, y0 = bounds[:, 0].min(), bounds[:, 1].min()
+    col = np.rint((bounds[:, 0] - x0) / size).astype(np.int64)
+    row = np.rint((bounds[:, 1] - y0) / size).astype(np.int64)
+    n_cols, n_rows = col.max() + 1, row.max() + 1
+
+    coords = shapely.get_coordinates(np.asarray(points))
+    ix = np.floor((coords[:, 0] - x0) / size).astype(np.int64)
+    iy = np.floor((coords[:, 1] - y0) / size).astype(np.int64)
+    inside = (ix >= 0) & (ix < n_cols) & (iy >= 0) & (iy < n_rows)
+    counts = np.bincount(ix[inside] * n_rows + iy[inside], minlength=n_cols * n_rows)
+    return counts[col * n_rows + row]
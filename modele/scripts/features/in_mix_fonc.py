@@ -62,13 +62,20 @@ def compute_indice_mixite_fonctionnelle(grid: gpd.GeoDataFrame) -> pd.DataFrame:
 
         # Compute Shannon entropy per grid cell
         print_status("Computing Shannon entropy", "info")
-        def entropy(group):
-            counts = group["fonction"].value_counts()
-            probs = counts / counts.sum()
-            return -(probs * np.log(probs)).sum()
+        # Counts matrix (grid cell × function), cells without establishment kept as rows of zeros.
+        # The join repeats the grid index, so it is reset for crosstab to align the two columns.
+        joined = joined.reset_index(drop=True)
+        cells = np.sort(joined["idINSPIRE"].unique())
+        counts = pd.crosstab(joined["idINSPIRE"], joined["fonction"]).reindex(cells, fill_value=0)
+        counts = counts.to_numpy(dtype=np.float64)
 
-        entropies = joined.groupby("idINSPIRE", group_keys=False).apply(entropy).reset_index(name="indice_mixite_fonctionnelle")
-        return entropies
+        # H = -Σ p·log(p) over the functions present in each cell, in one vectorized pass
+        totals = counts.sum(axis=1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            probs = counts / totals
+            terms = np.where(counts > 0, probs * np.log(probs), 0.0)
+
+        return pd.DataFrame({"idINSPIRE": cells, "indice_mixite_fonctionnelle": -terms.sum(axis=1)})
 
     except Exception as e:
         print_status("Error computing indice_mixite_fonctionnelle", "err", str(e))
@@ -28,7 +28,16 @@ y_train_jour = train_df["population_jour"]
 y_train_nuit = train_df["population_nuit"]
 
 # === 2. Load features to predict (dynamic department) ===
-test_df = pd.read_csv(f"appli/output/fusion/features_fusionnees_{DEPARTMENT_NUMBER}m.csv")
+# Read the most recently written copy of the merged features (Parquet or CSV)
+fusion_path = f"appli/output/fusion/features_fusionnees_{DEPARTMENT_NUMBER}m"
+fusion_file = max(
+    (p for p in (f"{fusion_path}.parquet", f"{fusion_path}.csv") if os.path.exists(p)),
+    key=os.path.getmtime,
+)
+if fusion_file.endswith(".parquet"):
+    test_df = pd.read_parquet(fusion_file)
+else:
+    test_df = pd.read_csv(fusion_file)
 test_df["idINSPIRE"] = test_df["idINSPIRE"].astype(str)
 
 # Harmonize column names